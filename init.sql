@@ -40,7 +40,10 @@ CREATE TABLE IF NOT EXISTS processing_tasks (
     error_message TEXT,
     started_at TIMESTAMP WITH TIME ZONE,
     completed_at TIMESTAMP WITH TIME ZONE,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    locked_by VARCHAR(255),
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    attempts INTEGER DEFAULT 0
 );
 
 -- Создание таблицы для результатов
@@ -72,13 +75,14 @@ CREATE INDEX IF NOT EXISTS idx_projects_status ON projects(status);
 CREATE INDEX IF NOT EXISTS idx_projects_created_at ON projects(created_at);
 CREATE INDEX IF NOT EXISTS idx_tasks_project_id ON processing_tasks(project_id);
 CREATE INDEX IF NOT EXISTS idx_tasks_status ON processing_tasks(status);
+CREATE INDEX IF NOT EXISTS idx_tasks_queue ON processing_tasks(created_at) WHERE status IN ('queued', 'processing');
 CREATE INDEX IF NOT EXISTS idx_results_project_id ON results(project_id);
 
 -- Вставка базовых настроек
 INSERT INTO settings (key, value, description) VALUES
 ('default_fps', '25', 'Частота кадров по умолчанию'),
 ('default_img_size', '96', 'Размер изображения по умолчанию'),
-('max_batch_size', '4', 'Максимальный размер батча'),
+('max_batch_size', '128', 'Максимальный размер батча Wav2Lip (фактический подбирается автоматически)'),
 ('temp_dir', '/tmp/wav2lip', 'Директория для временных файлов'),
 ('output_dir', '/output', 'Директория для результатов'),
 ('gpu_enabled', 'true', 'Включить GPU ускорение'),
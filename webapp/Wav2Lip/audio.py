@@ -1,6 +1,9 @@
+import subprocess
+
 import librosa
 import librosa.filters
 import numpy as np
+import torch
 
 # import tensorflow as tf
 from scipy import signal
@@ -13,6 +16,25 @@ def load_wav(path, sr):
     return librosa.core.load(path, sr=sr)[0]
 
 
+def load_audio(path, sr, ffmpeg="ffmpeg"):
+    """Decodes any format ffmpeg understands straight into a mono float32 array
+    at ``sr``: ffmpeg resamples and writes raw f32le samples to stdout, so there
+    is no temporary wav and no second resampling pass in librosa."""
+    command = [
+        ffmpeg, "-nostdin", "-loglevel", "error",
+        "-i", path,
+        "-vn", "-ac", "1", "-ar", str(sr),
+        "-f", "f32le", "-acodec", "pcm_f32le", "pipe:1",
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(
+            "ffmpeg failed to decode %s: %s"
+            % (path, result.stderr.decode("utf-8", "replace").strip())
+        )
+    return np.frombuffer(result.stdout, dtype="<f4")
+
+
 def save_wav(wav, path, sr):
     wav *= 32767 / max(0.01, np.max(np.abs(wav)))
     # proposed by @dsmiller
@@ -61,6 +83,61 @@ def melspectrogram(wav):
     return S
 
 
+def melspectrogram_torch(wav, device="cpu", chunk_frames=8192):
+    """Same result as ``melspectrogram`` computed with torch on ``device``.
+
+    The signal is processed in chunks of ``chunk_frames`` STFT frames; every
+    chunk takes the samples its frames overlap (plus one for pre-emphasis), so
+    memory stays bounded for long audio and the output matches ``_stft``
+    (``center=True``, ``pad_mode="constant"``).
+    """
+    if hp.use_lws:
+        raise ValueError("torch mel backend does not support hp.use_lws")
+
+    wav = np.asarray(wav)
+    hop = get_hop_size()
+    n_fft = hp.n_fft
+    half = n_fft // 2
+    n_frames = 1 + len(wav) // hop
+
+    window = torch.hann_window(hp.win_size, periodic=True, device=device)
+    mel_basis = _torch_mel_basis(device)
+    mel = np.empty((hp.num_mels, n_frames), dtype=np.float32)
+
+    with torch.no_grad():
+        for f0 in range(0, n_frames, chunk_frames):
+            f1 = min(f0 + chunk_frames, n_frames)
+            # Отсчеты [start, end) исходного сигнала, покрываемые кадрами f0..f1
+            start = f0 * hop - half
+            end = (f1 - 1) * hop + half
+            lo, hi = max(start, 0), min(end, len(wav))
+
+            seg = torch.as_tensor(
+                wav[max(lo - 1, 0) : hi], dtype=torch.float32, device=device
+            )
+            if hp.preemphasize:
+                if lo > 0:
+                    seg = seg[1:] - hp.preemphasis * seg[:-1]
+                else:
+                    seg = torch.cat([seg[:1], seg[1:] - hp.preemphasis * seg[:-1]])
+            seg = torch.nn.functional.pad(seg, (lo - start, end - hi))
+
+            spec = torch.stft(
+                seg,
+                n_fft=n_fft,
+                hop_length=hop,
+                win_length=hp.win_size,
+                window=window,
+                center=False,
+                return_complex=True,
+            ).abs()
+            S = _amp_to_db_torch(mel_basis @ spec) - hp.ref_level_db
+            if hp.signal_normalization:
+                S = _normalize_torch(S)
+            mel[:, f0:f1] = S.cpu().numpy()
+    return mel
+
+
 def _lws_processor():
     import lws
 
@@ -71,8 +148,14 @@ def _stft(y):
     if hp.use_lws:
         return _lws_processor(hp).stft(y).T
     else:
+        # pad_mode задан явно: значение по умолчанию менялось между версиями librosa,
+        # а melspectrogram_torch дополняет края нулями
         return librosa.stft(
-            y=y, n_fft=hp.n_fft, hop_length=get_hop_size(), win_length=hp.win_size
+            y=y,
+            n_fft=hp.n_fft,
+            hop_length=get_hop_size(),
+            win_length=hp.win_size,
+            pad_mode="constant",
         )
 
 
@@ -124,10 +207,28 @@ def _linear_to_mel(spectogram):
     return np.dot(_mel_basis, spectogram)
 
 
+_torch_mel_bases = {}
+
+
+def _torch_mel_basis(device):
+    basis = _torch_mel_bases.get(str(device))
+    if basis is None:
+        global _mel_basis
+        if _mel_basis is None:
+            _mel_basis = _build_mel_basis()
+        basis = torch.as_tensor(_mel_basis, dtype=torch.float32, device=device)
+        _torch_mel_bases[str(device)] = basis
+    return basis
+
+
 def _build_mel_basis():
     assert hp.fmax <= hp.sample_rate // 2
     return librosa.filters.mel(
-        hp.sample_rate, hp.n_fft, n_mels=hp.num_mels, fmin=hp.fmin, fmax=hp.fmax
+        sr=hp.sample_rate,
+        n_fft=hp.n_fft,
+        n_mels=hp.num_mels,
+        fmin=hp.fmin,
+        fmax=hp.fmax,
     )
 
 
@@ -136,6 +237,11 @@ def _amp_to_db(x):
     return 20 * np.log10(np.maximum(min_level, x))
 
 
+def _amp_to_db_torch(x):
+    min_level = np.exp(hp.min_level_db / 20 * np.log(10))
+    return 20 * torch.log10(torch.clamp(x, min=min_level))
+
+
 def _db_to_amp(x):
     return np.power(10.0, (x) * 0.05)
 
@@ -165,6 +271,47 @@ def _normalize(S):
         return hp.max_abs_value * ((S - hp.min_level_db) / (-hp.min_level_db))
 
 
+def silent_level():
+    """Value of a fully silent cell in the normalized mel."""
+    return -hp.max_abs_value if hp.symmetric_mels else 0.0
+
+
+def silent_frames(chunks, threshold_db=-60.0, min_frames=8, margin=2):
+    """Boolean mask over the frames of ``chunks`` (``MelChunks``) marking pauses.
+
+    A frame is silent when no mel band in its whole window is louder than
+    ``threshold_db`` (relative to ``hp.ref_level_db``). Only runs of at least
+    ``min_frames`` silent frames count, and ``margin`` frames at each end of a
+    run are left to the network so the mouth can close and open smoothly.
+    """
+    # Максимум по полосам до перевода в дБ: преобразование монотонно
+    loudness = _denormalize(np.asarray(chunks.mel).max(axis=0))
+    window = np.lib.stride_tricks.sliding_window_view(loudness, chunks.step)
+    silent = window.max(axis=1)[chunks.starts] < threshold_db
+
+    mask = np.zeros(len(silent), dtype=bool)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], silent.view(np.int8), [0]))))
+    for begin, end in zip(edges[::2], edges[1::2]):
+        if end - begin >= min_frames:
+            mask[begin + margin : end - margin] = True
+    return mask
+
+
+def _normalize_torch(S):
+    # Повторяет _normalize для тензоров
+    if hp.symmetric_mels:
+        S = (2 * hp.max_abs_value) * (
+            (S - hp.min_level_db) / (-hp.min_level_db)
+        ) - hp.max_abs_value
+        low = -hp.max_abs_value
+    else:
+        S = hp.max_abs_value * ((S - hp.min_level_db) / (-hp.min_level_db))
+        low = 0
+    if hp.allow_clipping_in_normalization:
+        S = torch.clamp(S, low, hp.max_abs_value)
+    return S
+
+
 def _denormalize(D):
     if hp.allow_clipping_in_normalization:
         if hp.symmetric_mels:
@@ -184,3 +331,50 @@ def _denormalize(D):
         ) + hp.min_level_db
     else:
         return (D * -hp.min_level_db / hp.max_abs_value) + hp.min_level_db
+
+
+class MelChunks:
+    """Mel windows of ``step`` columns, one per video frame.
+
+    All windows are strided views into a single mel array: indexing with an
+    integer returns a view, slicing gathers the requested windows into one
+    contiguous ``(n, num_mels, step)`` array, ready to be used as a batch.
+    The window starts follow the original per-frame loop: frame ``i`` starts at
+    ``int(i * 80 / fps)`` and the last window is aligned to the end of the mel.
+    """
+
+    def __init__(self, mel, fps, step=16):
+        mel = np.asarray(mel)
+        n_columns = mel.shape[1]
+        if n_columns < step:
+            raise ValueError("Audio is too short: %d mel frames" % n_columns)
+
+        last_start = n_columns - step
+        mel_idx_multiplier = 80.0 / fps
+        candidates = (
+            np.arange(int(last_start / mel_idx_multiplier) + 2) * mel_idx_multiplier
+        ).astype(np.int64)
+        n_full = np.searchsorted(candidates, last_start, side="right")
+
+        self.mel = mel
+        self.step = step
+        self.starts = np.append(candidates[:n_full], last_start)
+        # (num_mels, n_columns - step + 1, step) -> (n_windows, num_mels, step)
+        self.windows = np.lib.stride_tricks.sliding_window_view(
+            mel, step, axis=1
+        ).transpose(1, 0, 2)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        # Целый индекс дает view, срез - один сбор окон в непрерывный массив
+        return self.windows[self.starts[index]]
+
+    def __iter__(self):
+        for start in self.starts:
+            yield self.windows[start]
+
+    def __array__(self, dtype=None, copy=None):
+        batch = self.windows[self.starts]
+        return batch if dtype is None else batch.astype(dtype)
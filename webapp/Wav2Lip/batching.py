@@ -0,0 +1,101 @@
+import os
+import threading
+
+import torch
+
+# Лучший найденный размер батча для каждого (модель, устройство, разрешение)
+_lock = threading.Lock()
+_best_sizes = {}
+
+
+def available_memory(device):
+    if "cuda" in device and torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free
+
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+
+def remembered_size(key):
+    with _lock:
+        return _best_sizes.get(key)
+
+
+class AdaptiveBatchSizer:
+    """Chooses a batch size at run time.
+
+    Starts from one item (or from the size remembered for ``key``), doubles the
+    batch while measured items/second improves by more than ``min_gain`` and the
+    estimated memory use still fits into ``memory_fraction`` of the free device
+    memory, then settles on the fastest size seen. ``shrink()`` is called on
+    out-of-memory errors and caps every later batch for the same key.
+    """
+
+    def __init__(
+        self,
+        key,
+        device,
+        item_bytes,
+        max_size=256,
+        min_gain=0.05,
+        memory_fraction=0.5,
+    ):
+        self.key = key
+        self.min_gain = min_gain
+        memory_cap = int(available_memory(device) * memory_fraction) // max(
+            int(item_bytes), 1
+        )
+        self.max_size = max(1, min(max_size, memory_cap))
+
+        remembered = remembered_size(key)
+        if remembered is not None:
+            self.size = min(remembered, self.max_size)
+            self.tuning = False
+        else:
+            self.size = 1
+            self.tuning = True
+
+        self.best_size = self.size
+        self.best_rate = 0.0
+        self._warmed_up = False
+        self.largest = 0  # наибольший батч, который действительно был выполнен
+
+    def report(self, n_items, seconds):
+        if not self.tuning or n_items < self.size:
+            return
+
+        # Первый батч включает инициализацию (cudnn, аллокации) и не показателен
+        if not self._warmed_up:
+            self._warmed_up = True
+            return
+
+        rate = n_items / max(seconds, 1e-9)
+        if rate > self.best_rate * (1 + self.min_gain):
+            self.best_size, self.best_rate = self.size, rate
+            if self.size * 2 <= self.max_size:
+                self.size *= 2
+                return
+
+        self.size = self.best_size
+        self._finish()
+
+    def shrink(self):
+        if self.size == 1:
+            return False
+        self.size //= 2
+        self.max_size = self.size
+        self.best_size = min(self.best_size, self.size)
+        self._finish()
+        return True
+
+    def _finish(self):
+        self.tuning = False
+        with _lock:
+            _best_sizes[self.key] = self.size
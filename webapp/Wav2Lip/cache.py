@@ -0,0 +1,148 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+_digest_lock = threading.Lock()
+_digests = {}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    # Хеш содержимого запоминается по (путь, размер, mtime), чтобы не читать файл повторно
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digests.get(memo_key)
+    if digest is not None:
+        return digest
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _digest_lock:
+        _digests[memo_key] = digest
+    return digest
+
+
+def make_key(*parts):
+    return hashlib.sha256("|".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+
+class NpyCache:
+    """On-disk cache of numpy arrays with least-recently-used eviction.
+
+    Each entry is a single ``<key>.npy`` file; the file mtime is refreshed on
+    every hit and the oldest files are removed once the directory grows past
+    ``max_bytes``. Writes go through a temporary file and ``os.replace`` so
+    several workers can share one directory.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key, mmap_mode=None):
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # Поврежденная запись (например, оборванная запись на диск)
+            self.discard(key)
+            return None
+        return array
+
+    def put(self, key, array):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def discard(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".npy"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class FaceFeatureCache:
+    """In-memory LRU of face-encoder features, keyed by frame index.
+
+    Each entry holds the skip features of one frame (one tensor per encoder
+    block); the cache keeps at most ``max_bytes`` of them, on whatever device
+    they were computed on.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        feats = self._entries.get(key)
+        if feats is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return feats
+
+    def put(self, key, feats):
+        size = sum(f.nelement() * f.element_size() for f in feats)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= sum(f.nelement() * f.element_size() for f in old)
+
+        self._entries[key] = feats
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= sum(f.nelement() * f.element_size() for f in evicted)
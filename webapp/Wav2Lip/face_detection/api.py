@@ -55,6 +55,7 @@ class FaceAlignment:
         flip_input=False,
         face_detector="sfd.sfd_detector",
         verbose=False,
+        face_detector_kwargs=None,
     ):
         self.device = device
         self.flip_input = flip_input
@@ -75,7 +76,7 @@ class FaceAlignment:
             0,
         )
         self.face_detector = face_detector_module.SFDDetector(
-            device=device, verbose=verbose
+            device=device, verbose=verbose, **(face_detector_kwargs or {})
         )
 
     def get_detections_for_batch(self, images):
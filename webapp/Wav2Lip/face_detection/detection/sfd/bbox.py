@@ -59,6 +59,49 @@ def nms(dets, thresh):
     return keep
 
 
+def batch_nms(dets, thresh, score_thresh=0.0):
+    """Non-maximum suppression for every image of a detection batch at once.
+
+    Boxes with a score not above ``score_thresh`` are dropped first. The rest of
+    the batch is sorted by score and suppressed in a single loop over kept boxes;
+    each iteration compares the kept box with all remaining boxes of the batch,
+    overlaps between different images are ignored.
+
+    Arguments:
+        dets {numpy.ndarray} -- [num_boxes, batch_size, 5] array as returned by
+        ``batch_detect``
+        thresh {float} -- IoU threshold
+        score_thresh {float} -- minimal score of a box to be considered
+
+    Returns:
+        list of [num_kept, 5] arrays, one per image, sorted by descending score
+    """
+    num_images = dets.shape[1]
+    image_idx, box_idx = np.nonzero(dets[:, :, 4].T > score_thresh)
+    boxes = dets[box_idx, image_idx]
+
+    x1, y1, x2, y2, scores = (boxes[:, k] for k in range(5))
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = np.argsort(-scores, kind="stable")
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        xx1, yy1 = np.maximum(x1[i], x1[rest]), np.maximum(y1[i], y1[rest])
+        xx2, yy2 = np.minimum(x2[i], x2[rest]), np.minimum(y2[i], y2[rest])
+
+        w, h = np.maximum(0.0, xx2 - xx1 + 1), np.maximum(0.0, yy2 - yy1 + 1)
+        ovr = w * h / (areas[i] + areas[rest] - w * h)
+        ovr[image_idx[rest] != image_idx[i]] = 0.0
+
+        order = rest[ovr <= thresh]
+
+    keep = np.array(keep, dtype=np.int64)
+    return [boxes[keep[image_idx[keep] == n]] for n in range(num_images)]
+
+
 def encode(matched, priors, variances):
     """Encode the variances from the priorbox layers into the ground truth boxes
     we have matched (based on jaccard overlap) with the prior boxes.
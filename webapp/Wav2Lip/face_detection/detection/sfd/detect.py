@@ -6,6 +6,48 @@ import torch.nn.functional as F
 from .bbox import *
 
 
+def decode_outputs(olist, threshold=0.05):
+    """Decodes the raw S3FD outputs of a whole batch in one pass on the device.
+
+    Anchor positions are kept if the face score of any image in the batch is
+    above ``threshold``; only those boxes are transferred to the CPU.
+
+    Returns:
+        numpy array of shape [num_boxes, batch_size, 5] with (x1, y1, x2, y2, score)
+        rows, or an empty [0, batch_size, 5] array.
+    """
+    variances = [0.1, 0.2]
+    bboxlist = []
+    for i in range(len(olist) // 2):
+        ocls = F.softmax(olist[i * 2], dim=1)
+        oreg = olist[i * 2 + 1]
+        stride = 2 ** (i + 2)  # 4,8,16,32,64,128
+
+        scores = ocls[:, 1, :, :]
+        hindex, windex = torch.nonzero((scores > threshold).any(dim=0), as_tuple=True)
+        if len(hindex) == 0:
+            continue
+
+        anchor = torch.full_like(hindex, stride * 4)
+        priors = torch.stack(
+            [
+                stride / 2 + windex * stride,
+                stride / 2 + hindex * stride,
+                anchor,
+                anchor,
+            ],
+            dim=1,
+        ).float()
+        loc = oreg[:, :, hindex, windex].permute(2, 0, 1)
+        box = batch_decode(loc, priors.unsqueeze(1), variances)
+        score = scores[:, hindex, windex].t().unsqueeze(2)
+        bboxlist.append(torch.cat([box, score], 2))
+
+    if not bboxlist:
+        return np.zeros((0, olist[0].size(0), 5), dtype=np.float32)
+    return torch.cat(bboxlist).cpu().numpy()
+
+
 def detect(net, img, device):
     img = img - np.array([104, 117, 123])
     img = img.transpose(2, 0, 1)
@@ -15,33 +57,10 @@ def detect(net, img, device):
         torch.backends.cudnn.benchmark = True
 
     img = torch.from_numpy(img).float().to(device)
-    BB, CC, HH, WW = img.size()
     with torch.no_grad():
         olist = net(img)
+        bboxlist = decode_outputs(olist)[:, 0, :]
 
-    bboxlist = []
-    for i in range(len(olist) // 2):
-        olist[i * 2] = F.softmax(olist[i * 2], dim=1)
-    olist = [oelem.data.cpu() for oelem in olist]
-    for i in range(len(olist) // 2):
-        ocls, oreg = olist[i * 2], olist[i * 2 + 1]
-        FB, FC, FH, FW = ocls.size()  # feature map size
-        stride = 2 ** (i + 2)  # 4,8,16,32,64,128
-        anchor = stride * 4
-        poss = zip(*np.where(ocls[:, 1, :, :] > 0.05))
-        for Iindex, hindex, windex in poss:
-            axc, ayc = stride / 2 + windex * stride, stride / 2 + hindex * stride
-            score = ocls[0, 1, hindex, windex]
-            loc = oreg[0, :, hindex, windex].contiguous().view(1, 4)
-            priors = torch.Tensor(
-                [[axc / 1.0, ayc / 1.0, stride * 4 / 1.0, stride * 4 / 1.0]]
-            )
-            variances = [0.1, 0.2]
-            box = decode(loc, priors, variances)
-            x1, y1, x2, y2 = box[0] * 1.0
-            # cv2.rectangle(imgshow,(int(x1),int(y1)),(int(x2),int(y2)),(0,0,255),1)
-            bboxlist.append([x1, y1, x2, y2, score])
-    bboxlist = np.array(bboxlist)
     if 0 == len(bboxlist):
         bboxlist = np.zeros((1, 5))
 
@@ -59,30 +78,8 @@ def batch_detect(net, imgs, device):
     BB, CC, HH, WW = imgs.size()
     with torch.no_grad():
         olist = net(imgs)
+        bboxlist = decode_outputs(olist)
 
-    bboxlist = []
-    for i in range(len(olist) // 2):
-        olist[i * 2] = F.softmax(olist[i * 2], dim=1)
-    olist = [oelem.data.cpu() for oelem in olist]
-    for i in range(len(olist) // 2):
-        ocls, oreg = olist[i * 2], olist[i * 2 + 1]
-        FB, FC, FH, FW = ocls.size()  # feature map size
-        stride = 2 ** (i + 2)  # 4,8,16,32,64,128
-        anchor = stride * 4
-        poss = zip(*np.where(ocls[:, 1, :, :] > 0.05))
-        for Iindex, hindex, windex in poss:
-            axc, ayc = stride / 2 + windex * stride, stride / 2 + hindex * stride
-            score = ocls[:, 1, hindex, windex]
-            loc = oreg[:, :, hindex, windex].contiguous().view(BB, 1, 4)
-            priors = torch.Tensor(
-                [[axc / 1.0, ayc / 1.0, stride * 4 / 1.0, stride * 4 / 1.0]]
-            ).view(1, 1, 4)
-            variances = [0.1, 0.2]
-            box = batch_decode(loc, priors, variances)
-            box = box[:, 0] * 1.0
-            # cv2.rectangle(imgshow,(int(x1),int(y1)),(int(x2),int(y2)),(0,0,255),1)
-            bboxlist.append(torch.cat([box, score.unsqueeze(1)], 1).cpu().numpy())
-    bboxlist = np.array(bboxlist)
     if 0 == len(bboxlist):
         bboxlist = np.zeros((1, BB, 5))
 
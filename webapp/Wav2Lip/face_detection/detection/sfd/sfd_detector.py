@@ -7,10 +7,6 @@ from .bbox import *
 from .detect import *
 from .net_s3fd import s3fd
 
-models_urls = {
-    "s3fd": "https://www.adrianbulat.com/downloads/python-fan/s3fd-619a316812.pth",
-}
-
 
 class SFDDetector(FaceDetector):
     def __init__(
@@ -20,37 +16,47 @@ class SFDDetector(FaceDetector):
             os.path.dirname(os.path.abspath(__file__)), "s3fd.pth"
         ),
         verbose=False,
+        backend="torch",
+        onnx_path=None,
+        intra_op_threads=0,
+        inter_op_threads=0,
     ):
         super(SFDDetector, self).__init__(device, verbose)
 
+        if backend == "onnx":
+            from Wav2Lip.onnx_backend import OnnxS3FD
+
+            self.face_detector = OnnxS3FD(
+                onnx_path, intra_op_threads, inter_op_threads, device
+            )
+            return
+        if backend != "torch":
+            raise ValueError("Unknown S3FD backend: %s" % backend)
+
+        # Загрузчики и адрес весов общие с командами подготовки моделей
+        from Wav2Lip.weights import S3FD_URL, build, load_weights
+
         # Initialise the face detector
         if not os.path.isfile(path_to_detector):
-            model_weights = load_url(models_urls["s3fd"])
+            model_weights = load_url(S3FD_URL)
         else:
-            model_weights = torch.load(path_to_detector)
+            model_weights = load_weights(path_to_detector)
 
-        self.face_detector = s3fd()
-        self.face_detector.load_state_dict(model_weights)
-        self.face_detector.to(device)
-        self.face_detector.eval()
+        self.face_detector = build(s3fd, model_weights, device)
 
     def detect_from_image(self, tensor_or_path):
         image = self.tensor_or_path_to_ndarray(tensor_or_path)
 
         bboxlist = detect(self.face_detector, image, device=self.device)
-        keep = nms(bboxlist, 0.3)
-        bboxlist = bboxlist[keep, :]
-        bboxlist = [x for x in bboxlist if x[-1] > 0.5]
+        bboxlist = batch_nms(bboxlist[:, None, :], 0.3, score_thresh=0.5)[0]
 
-        return bboxlist
+        return list(bboxlist)
 
     def detect_from_batch(self, images):
         bboxlists = batch_detect(self.face_detector, images, device=self.device)
-        keeps = [nms(bboxlists[:, i, :], 0.3) for i in range(bboxlists.shape[1])]
-        bboxlists = [bboxlists[keep, i, :] for i, keep in enumerate(keeps)]
-        bboxlists = [[x for x in bboxlist if x[-1] > 0.5] for bboxlist in bboxlists]
+        bboxlists = batch_nms(bboxlists, 0.3, score_thresh=0.5)
 
-        return bboxlists
+        return [list(bboxlist) for bboxlist in bboxlists]
 
     @property
     def reference_scale(self):
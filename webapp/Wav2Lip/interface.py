@@ -1,14 +1,76 @@
+import multiprocessing
 import os
-import platform
-import subprocess
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import cv2
 import numpy as np
 import torch
 
-from Wav2Lip import audio
-from Wav2Lip.face_detection.api import FaceAlignment, LandmarksType
-from Wav2Lip.models.wav2lip import Wav2Lip
+from Wav2Lip import audio, model_registry, smoothing
+from Wav2Lip.batching import AdaptiveBatchSizer
+from Wav2Lip.cache import FaceFeatureCache, NpyCache, file_digest, make_key
+from Wav2Lip.onnx_backend import OnnxOptions
+from Wav2Lip.pipeline import Pipeline, Stage
+from Wav2Lip.video_writer import FFmpegWriter, concat_segments
+
+# Увеличивается при изменении алгоритма детекции или формата кеша, чтобы сбросить кеш боксов
+FACE_CACHE_VERSION = 4
+# То же для кеша мел-спектрограмм
+MEL_CACHE_VERSION = 2
+
+# Расширения файлов-фотографий, которые обрабатываются в режиме статичного аватара
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Минимальная длина сегмента при рендере по частям (10 с при 25 fps): на коротких
+# сегментах запуск процессов и загрузка моделей не окупаются
+MIN_SEGMENT_FRAMES = 250
+
+# Признаки энкодера лица одного кадра 96x96 в float32 (skip-выходы всех блоков)
+FACE_FEATURE_BYTES = 1163264
+
+# Грубая оценка памяти S3FD на пиксель входа (активации первых слоев в float32)
+S3FD_BYTES_PER_PIXEL = 600
+# То же для Wav2Lip на один кадр 96x96 (skip-признаки энкодера и декодер)
+WAV2LIP_BYTES_PER_ITEM = 8 * 1024 * 1024
+
+
+def _init_segment_worker(threads):
+    # Процессы сегментов делят между собой потоки родительского процесса
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+
+def _render_segment(settings, mel_path, boxes_path, start, end, output_path):
+    wav2lip = Wav2LipInterface(None, None)
+    vars(wav2lip).update(settings)
+    mel_chunks = audio.MelChunks(np.load(mel_path, mmap_mode="r"), wav2lip.fps, 16)
+    boxes = None if boxes_path is None else np.load(boxes_path, mmap_mode="r")
+
+    started = time.perf_counter()
+    wav2lip.render(mel_chunks, boxes, output_path, None, start, end)
+    wav2lip.run_info.update(
+        start=start, end=end, seconds=round(time.perf_counter() - started, 3)
+    )
+    return wav2lip.run_info
+
+
+def _numbered(batches, start):
+    # Пары (номер первого кадра, батч); длина батча - число мел-окон в нем
+    pos = start
+    for batch in batches:
+        yield pos, batch
+        pos += len(batch[1]) if isinstance(batch, tuple) else len(batch)
+
+
+def _frame_difference(a, b, size=32):
+    if a.size == 0 or b.size == 0:
+        return 0.0
+    a = cv2.resize(a, (size, size), interpolation=cv2.INTER_AREA)
+    b = cv2.resize(b, (size, size), interpolation=cv2.INTER_AREA)
+    return float(cv2.absdiff(a, b).mean())
 
 
 class Wav2LipInterface:
@@ -27,105 +89,255 @@ class Wav2LipInterface:
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.img_size = 96
         self.checkpoint_path = os.path.join(base_dir, "checkpoints/wav2lip_gan.pth")
+        # INT8-модели для CPU (готовятся заранее: python -m Wav2Lip.quantization)
+        self.quantize = False
+        self.quantized_dir = os.path.join(base_dir, "cache", "quantized")
+        # "torch" или "onnx" (модели экспортируются заранее: python -m Wav2Lip.onnx_backend)
+        self.backend = "torch"
+        self.onnx_dir = os.path.join(base_dir, "cache", "onnx")
+        self.ort_intra_op_threads = 0  # 0 - по умолчанию ONNX Runtime
+        self.ort_inter_op_threads = 0
+        # Веса без лишнего из чекпоинта, загружаются через mmap
+        # (готовятся заранее: python -m Wav2Lip.prepare_models)
+        self.prepared_dir = os.path.join(base_dir, "cache", "prepared")
         self.pads = [0, 10, 0, 0]
         self.nosmooth = False
+        self.smoothing = "mean"  # "mean", "ema" или "one_euro"
+        self.smoothing_params = {}
         self.box = [-1, -1, -1, -1]
-        self.wav2lip_batch_size = 1
+        self.wav2lip_batch_size = None  # None - подбирается автоматически
+        self.wav2lip_max_batch_size = 128
         self.fps = 25  # Устанавливаем значение по умолчанию
-        self.resize_factor = 1
+        self.resize_factor = None  # None - подбирается по размеру кадра
+        self.face_det_max_side = 720  # максимальная сторона кадра для детекции
         self.crop = [0, -1, 0, -1]
         self.rotate = False
+        self.static = None  # None - статичный режим для фотографий (IMAGE_EXTENSIONS)
+        self.run_info = {}  # фактические параметры последнего запуска
+        self.face_cache_dir = os.path.join(base_dir, "cache", "faces")
+        self.face_cache_size = 256 * 1024 * 1024
+        self.audio_backend = "librosa"  # "librosa" или "torch"
+        self.mel_cache_dir = os.path.join(base_dir, "cache", "mels")
+        self.mel_cache_size = 512 * 1024 * 1024
+        # Признаки энкодера лица по номеру кадра (повторяющиеся кадры зацикленного
+        # видео не кодируются заново); включается, если весь цикл видео помещается
+        # в этот объем (см. use_feature_cache); 0 - без кеша
+        self.face_feature_cache_size = 512 * 1024 * 1024
+        self.face_det_batch_size = None  # None - подбирается автоматически
+        self.face_det_max_batch_size = 64
+        self.detect_every = 1  # 1 - детекция на каждом кадре
+        self.redetect_threshold = 12.0  # средняя разница яркости в области лица
+        self.scene_change_threshold = 30.0  # средняя разница яркости всего кадра
+        # Потоки стадий генерации; чтение видео, инференс и запись - по одному
+        self.pipeline_workers = {"prepare": 2, "paste": 2}
+        self.pipeline_queue_size = 2  # батчей в очереди между стадиями
+        self.x264_preset = "veryfast"
+        self.x264_crf = 18
+        self.encoder_threads = 0  # 0 - ffmpeg выбирает сам
+        # Рендер длинного ролика по сегментам в отдельных процессах; 1 - без деления
+        self.segments = 1
+        self.segment_workers = None  # None - по процессу на сегмент
+        # Паузы в речи без прогона сети: "off", "passthrough" - исходный кадр,
+        # "cached" - одно предсказание для тишины на номер кадра
+        self.silence_mode = "off"
+        self.silence_threshold_db = -60.0  # относительно hp.ref_level_db
+        self.silence_min_frames = 8  # паузы короче не пропускаются
+        self.silence_margin = 2  # кадров на краях паузы остаются сети
+        self.silence_cache_size = 128 * 1024 * 1024
+
+    def is_image(self):
+        return str(self.video_path).lower().endswith(IMAGE_EXTENSIONS)
+
+    def is_still(self):
+        if self.static is not None:
+            return self.static
+        return self.is_image()
+
+    def iter_frames(self, limit=None, start=0):
+        y1, y2, x1, x2 = self.crop
+        if self.is_image():
+            frame = cv2.imread(self.video_path)
+            if frame is None:
+                raise ValueError("Could not read image %s" % self.video_path)
+            if start == 0 and (limit is None or limit > 0):
+                yield frame[
+                    y1 : frame.shape[0] if y2 == -1 else y2,
+                    x1 : frame.shape[1] if x2 == -1 else x2,
+                ]
+            return
 
-    def process_video(self):
         video_stream = cv2.VideoCapture(self.video_path)
-
-        full_frames = []
-        while True:
-            still_reading, frame = video_stream.read()
-            if not still_reading:
-                video_stream.release()
-                break
-
-            y1, y2, x1, x2 = self.crop
-            if x2 == -1:
-                x2 = frame.shape[1]
-            if y2 == -1:
-                y2 = frame.shape[0]
-
-            frame = frame[y1:y2, x1:x2]
-
-            full_frames.append(frame)
-        return full_frames
-
-    def process_audio(self):
-        mel_step_size = 16
-        temp_path = os.path.join(self.temp_dir, "temp.wav")
-        if not self.audio_path.endswith(".wav"):
-            command = "ffmpeg -y -i {} -strict -2 {}".format(self.audio_path, temp_path)
-
-            subprocess.call(command, shell=True)
-            audio_path = temp_path
-
-        wav = audio.load_wav(audio_path, 16000)
-        mel = audio.melspectrogram(wav)
+        if start:
+            video_stream.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+        count = 0
+        try:
+            while limit is None or count < limit:
+                still_reading, frame = video_stream.read()
+                if not still_reading:
+                    break
+
+                frame = frame[
+                    y1 : frame.shape[0] if y2 == -1 else y2,
+                    x1 : frame.shape[1] if x2 == -1 else x2,
+                ]
+                count += 1
+                yield frame
+        finally:
+            video_stream.release()
+
+    def iter_looped_frames(self, n_frames, total, start=0):
+        # Кадры читаются заново при каждом проходе, а не хранятся в памяти;
+        # start - номер первого выходного кадра (для рендера по сегментам)
+        if n_frames <= 0:
+            raise ValueError("Video contains no frames")
+
+        produced = start
+        offset = start % n_frames
+        while produced < total:
+            read = 0
+            for frame in self.iter_frames(limit=n_frames - offset, start=offset):
+                yield frame
+                read += 1
+                produced += 1
+                if produced == total:
+                    return
+            if read == 0:
+                # Иначе пустой проход повторялся бы бесконечно
+                raise ValueError("Could not read frames from %s" % self.video_path)
+            offset = 0
+
+    def compute_mel(self):
+        if self.audio_backend not in ("librosa", "torch"):
+            raise ValueError("Unknown audio backend: %s" % self.audio_backend)
+        wav = audio.load_audio(self.audio_path, 16000)
+        if self.audio_backend == "torch":
+            mel = audio.melspectrogram_torch(wav, device=self.device)
+        else:
+            mel = audio.melspectrogram(wav)
 
         if np.isnan(mel.reshape(-1)).sum() > 0:
             raise ValueError(
                 "Mel contains nan! Using a TTS voice? Add a small epsilon noise to the wav file and try again"
             )
+        return mel
+
+    def mel_cache_key(self):
+        return make_key(
+            "mel",
+            MEL_CACHE_VERSION,
+            file_digest(self.audio_path),
+            sorted(audio.hp.data.items()),
+            self.audio_backend,
+        )
+
+    def audio_mel(self):
+        if not self.mel_cache_dir:
+            return self.compute_mel()
+
+        # Мел одного и того же аудио (повтор задачи, другой аватар) берется из
+        # кеша через mmap, без декодирования и STFT
+        cache = NpyCache(self.mel_cache_dir, self.mel_cache_size)
+        key = self.mel_cache_key()
+        mel = cache.get(key, mmap_mode="r")
+        self.run_info["mel_cache_hit"] = mel is not None
+        if mel is None:
+            mel = self.compute_mel()
+            cache.put(key, mel)
+        return mel
+
+    def process_audio(self):
+        mel_step_size = 16
+        mel = self.audio_mel()
 
-        mel_chunks = []
         # Защита от деления на ноль
         if self.fps <= 0:
             self.fps = 25  # Устанавливаем значение по умолчанию
             print(f"Warning: FPS was {self.fps}, setting to default value 25")
-        
-        mel_idx_multiplier = 80.0 / self.fps
-        i = 0
-        while True:
-            start_idx = int(i * mel_idx_multiplier)
-            if start_idx + mel_step_size > len(mel[0]):
-                mel_chunks.append(mel[:, len(mel[0]) - mel_step_size :])
-                break
-            mel_chunks.append(mel[:, start_idx : start_idx + mel_step_size])
-            i += 1
-        return mel_chunks
+
+        return audio.MelChunks(mel, self.fps, mel_step_size)
 
     def get_smoothened_boxes(self, boxes, T):
-        for i in range(len(boxes)):
-            if i + T > len(boxes):
-                window = boxes[len(boxes) - T :]
-            else:
-                window = boxes[i : i + T]
-            boxes[i] = np.mean(window, axis=0)
-        return boxes
+        if self.smoothing == "mean":
+            smoothed = smoothing.moving_average(boxes, T)
+        elif self.smoothing == "one_euro":
+            smoothed = smoothing.one_euro(boxes, fps=self.fps, **self.smoothing_params)
+        else:
+            smoothed = smoothing.FILTERS[self.smoothing](boxes, **self.smoothing_params)
+        return smoothed.astype(boxes.dtype)
+
+    def _detect_batch(self, detector, images, sizer):
+        try:
+            detections = detector.get_detections_for_batch(np.array(images))
+        except RuntimeError:
+            # Та же деградация, что и раньше: при нехватке памяти батч делится пополам
+            sizer.shrink()
+            if len(images) == 1:
+                raise RuntimeError(
+                    "Image too big to run face detection on GPU. Please set a larger resize_factor"
+                )
+            half = len(images) // 2
+            return self._detect_batch(
+                detector, images[:half], sizer
+            ) + self._detect_batch(detector, images[half:], sizer)
+        sizer.largest = max(sizer.largest, len(images))
+        return detections
+
+    def _make_sizer(self, key, item_bytes, batch_size, max_batch_size):
+        sizer = AdaptiveBatchSizer(
+            key,
+            self.device,
+            item_bytes=item_bytes,
+            max_size=batch_size or max_batch_size,
+        )
+        if batch_size:
+            sizer.size, sizer.tuning = sizer.max_size, False
+        return sizer
+
+    def _face_det_sizer(self, frame_shape):
+        h, w = frame_shape[:2]
+        return self._make_sizer(
+            ("s3fd", self.device, (h, w)),
+            h * w * S3FD_BYTES_PER_PIXEL,
+            self.face_det_batch_size,
+            self.face_det_max_batch_size,
+        )
 
-    def face_detect(self, images):
-        detector = FaceAlignment(
-            LandmarksType._2D, flip_input=False, device=self.device
+    def _wav2lip_sizer(self):
+        return self._make_sizer(
+            ("wav2lip", self.device, self.img_size),
+            WAV2LIP_BYTES_PER_ITEM,
+            self.wav2lip_batch_size,
+            self.wav2lip_max_batch_size,
         )
 
-        batch_size = 1
+    def detection_scale(self, frame_shape):
+        if self.resize_factor:
+            return float(self.resize_factor)
+        h, w = frame_shape[:2]
+        return max(1.0, max(h, w) / self.face_det_max_side)
+
+    def detection_size(self, frame_shape):
+        """Downscale factor and ``(width, height)`` of the S3FD input."""
+        scale = self.detection_scale(frame_shape)
+        return scale, (
+            max(1, int(round(frame_shape[1] / scale))),
+            max(1, int(round(frame_shape[0] / scale))),
+        )
 
-        while 1:
-            predictions = []
-            try:
-                for i in range(0, len(images), batch_size):
-                    predictions.extend(
-                        detector.get_detections_for_batch(
-                            np.array(images[i : i + batch_size])
-                        )
-                    )
-            except RuntimeError:
-                if batch_size == 1:
-                    raise RuntimeError(
-                        "Image too big to run face detection on GPU. Please use the --resize_factor argument"
-                    )
-                batch_size //= 2
-                continue
-            break
+    def detection_input(self, frame, scale, det_size):
+        if scale == 1.0:
+            return frame
+        return cv2.resize(frame, det_size, interpolation=cv2.INTER_AREA)
+
+    def _detect_keyframes(self, detector, images, sizer, frame_shape, scale):
+        # images уменьшены в scale раз, боксы переводятся в координаты исходного кадра
+        start = time.perf_counter()
+        predictions = self._detect_batch(detector, images, sizer)
+        sizer.report(len(images), time.perf_counter() - start)
 
         results = []
+        frame_h, frame_w = frame_shape[:2]
         pady1, pady2, padx1, padx2 = self.pads
         for rect, image in zip(predictions, images):
             if rect is None:
@@ -137,120 +349,612 @@ class Wav2LipInterface:
                     "Face not detected! Ensure the video contains a face in all the frames."
                 )
 
+            rect = [int(round(v * scale)) for v in rect]
             y1 = max(0, rect[1] - pady1)
-            y2 = min(image.shape[0], rect[3] + pady2)
+            y2 = min(frame_h, rect[3] + pady2)
             x1 = max(0, rect[0] - padx1)
-            x2 = min(image.shape[1], rect[2] + padx2)
+            x2 = min(frame_w, rect[2] + padx2)
 
             results.append([x1, y1, x2, y2])
+        return results
 
-        boxes = np.array(results)
-        if not self.nosmooth:
-            boxes = self.get_smoothened_boxes(boxes, T=5)
-        results = [
-            [image[y1:y2, x1:x2], (y1, y2, x1, x2)]
-            for image, (x1, y1, x2, y2) in zip(images, boxes)
-        ]
+    def _keyframe_reason(self, distance, key_gray, gray, box):
+        if _frame_difference(key_gray, gray) > self.scene_change_threshold:
+            return "scene"
+        if box is not None:
+            x1, y1, x2, y2 = box
+            roi_difference = _frame_difference(
+                key_gray[y1:y2, x1:x2], gray[y1:y2, x1:x2]
+            )
+            if roi_difference > self.redetect_threshold:
+                return "motion"
+        if distance >= self.detect_every:
+            return "interval"
+        return None
+
+    def detect_raw_boxes(self, frames):
+        # Боксы до сглаживания: по одному на кадр, в координатах исходного кадра
+        detector = model_registry.get_face_detector(
+            self.device, self._quantized_dir(), self._onnx_options(), self.prepared_dir
+        )
 
-        del detector
-        return results
+        # S3FD запускается только на ключевых кадрах: каждый detect_every-й кадр,
+        # смена сцены или заметное изменение области лица. Между плановыми
+        # ключевыми кадрами боксы интерполируются, а перед внеплановыми
+        # (смена сцены, движение) удерживается предыдущий бокс.
+        # Ключевые кадры копятся в батч. Движение проверяется в области лица
+        # последнего детектированного ключевого кадра: пока после него были только
+        # плановые ключевые кадры, лицо не сдвинулось и его бокс еще верен. Батч
+        # детектируется досрочно, только если в нем есть внеплановый ключевой кадр
+        # (лицо сдвинулось) или детектированного бокса еще нет.
+        key_indices, key_boxes, hold_before, batch = [], [], [], []
+        sizer, last_key = None, None
+        batch_moved = False
+        n_frames = 0
+
+        def flush():
+            key_boxes.extend(
+                self._detect_keyframes(detector, batch, sizer, frame_shape, scale)
+            )
+            batch.clear()
+
+        for idx, frame in enumerate(frames):
+            n_frames += 1
+            if sizer is None:
+                frame_shape = frame.shape
+                scale, det_size = self.detection_size(frame_shape)
+                sizer = self._face_det_sizer((det_size[1], det_size[0]))
+
+            frame = self.detection_input(frame, scale, det_size)
+
+            reason = "interval"
+            if self.detect_every > 1:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                if last_key is not None:
+                    if batch and (batch_moved or not key_boxes):
+                        flush()
+                        batch_moved = False
+                    known_box = [int(v / scale) for v in key_boxes[-1]]
+                    reason = self._keyframe_reason(
+                        idx - last_key[0], last_key[1], gray, known_box
+                    )
+                    if reason is None:
+                        continue
+                last_key = (idx, gray)
+
+            key_indices.append(idx)
+            hold_before.append(reason != "interval")
+            batch.append(frame)
+            batch_moved = batch_moved or reason != "interval"
+            if len(batch) >= sizer.size:
+                flush()
+                batch_moved = False
+
+        if batch:
+            flush()
+        if sizer is not None and sizer.largest:
+            self.run_info["face_det_batch_size"] = sizer.largest
+
+        boxes = np.array(key_boxes, dtype=int).reshape(-1, 4)
+        if len(key_indices) < n_frames:
+            positions = np.arange(n_frames)
+            boxes = np.stack(
+                [np.interp(positions, key_indices, boxes[:, c]) for c in range(4)],
+                axis=1,
+            )
+            boxes = np.round(boxes).astype(int)
+            for k in range(1, len(key_indices)):
+                if hold_before[k]:
+                    prev = key_indices[k - 1]
+                    boxes[prev + 1 : key_indices[k]] = boxes[prev]
+        return boxes
 
-    def datagen(self, frames, mels):
-        img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+    def smooth_boxes(self, boxes):
+        if self.nosmooth or len(boxes) == 0:
+            return boxes
+        return self.get_smoothened_boxes(boxes, T=5)
+
+    def detect_boxes(self, frames):
+        return self.smooth_boxes(self.detect_raw_boxes(frames))
+
+    def face_cache_key(self):
+        return make_key(
+            "faces",
+            FACE_CACHE_VERSION,
+            file_digest(self.video_path),
+            self.pads,
+            self.crop,
+            self.resize_factor,
+            self.face_det_max_side,
+            self.detect_every,
+            self.redetect_threshold,
+            self.scene_change_threshold,
+            self.quantize and self.device == "cpu",
+            self.backend,
+        )
 
-        if self.box[0] == -1:
-            face_det_results = self.face_detect(frames)
-        else:
+    def video_face_boxes(self, limit):
+        if self.box[0] != -1:
             y1, y2, x1, x2 = self.box
-            face_det_results = [[f[y1:y2, x1:x2], (y1, y2, x1, x2)] for f in frames]
+            n_frames = sum(1 for _ in self.iter_frames(limit=limit))
+            return np.tile([x1, y1, x2, y2], (n_frames, 1))
+
+        if not self.face_cache_dir:
+            return self.detect_boxes(self.iter_frames(limit=limit))
+
+        # В кеше хранятся несглаженные боксы начала видео: детектируются только
+        # кадры, которые нужны задаче, а следующая задача с более длинным аудио
+        # дочитывает видео с места, где остановилась предыдущая. Если кеш короче
+        # limit и дочитать нечего, видео закончилось и дальше оно зацикливается.
+        cache = NpyCache(self.face_cache_dir, self.face_cache_size)
+        key = self.face_cache_key()
+        boxes = cache.get(key)
+        covered = 0 if boxes is None else len(boxes)
+        self.run_info["face_cache_hit"] = boxes is not None
+        if covered < limit:
+            more = self.detect_raw_boxes(
+                self.iter_frames(limit=limit - covered, start=covered)
+            )
+            if len(more) or boxes is None:
+                boxes = more if boxes is None else np.concatenate([boxes, more])
+                cache.put(key, boxes)
+        return self.smooth_boxes(boxes[:limit])
+
+    def _face_input(self, img_batch):
+        img_batch = np.asarray(img_batch)
 
-        for i, m in enumerate(mels):
-            idx = i % len(frames)
-            frame_to_save = frames[idx].copy()
-            face, coords = face_det_results[idx].copy()
+        img_masked = img_batch.copy()
+        img_masked[:, self.img_size // 2 :] = 0
 
-            face = cv2.resize(face, (self.img_size, self.img_size))
+        return np.concatenate((img_masked, img_batch), axis=3) / 255.0
 
-            img_batch.append(face)
-            mel_batch.append(m)
-            frame_batch.append(frame_to_save)
-            coords_batch.append(coords)
+    def _mel_input(self, mel_batch):
+        mel_batch = np.asarray(mel_batch)
+        return np.reshape(
+            mel_batch,
+            [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1],
+        )
 
-            if len(img_batch) >= self.wav2lip_batch_size:
-                img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+    def _prepare_batch(self, img_batch, mel_batch):
+        return self._face_input(img_batch), self._mel_input(mel_batch)
+
+    def iter_raw_batches(self, mels, boxes, sizer, start=0, end=None):
+        # Первый проход хранит только координаты лиц, второй читает кадры заново,
+        # поэтому пиковая память зависит от размера батча, а не от длины видео
+        end = len(mels) if end is None else end
+        frames = self.iter_looped_frames(len(boxes), end, start)
+
+        # Мел-окна батча берутся одним срезом, без сборки по кадрам
+        frame_batch, coords_batch, index_batch = [], [], []
+        for i, frame in enumerate(frames, start):
+            idx = i % len(boxes)
+            x1, y1, x2, y2 = boxes[idx]
+            frame_batch.append(frame)
+            coords_batch.append((y1, y2, x1, x2))
+            index_batch.append(idx)
+
+            if len(frame_batch) >= sizer.size:
+                yield frame_batch, mels[start : i + 1], coords_batch, index_batch
+                frame_batch, coords_batch, index_batch = [], [], []
+                start = i + 1
+
+        if frame_batch:
+            yield frame_batch, mels[start:end], coords_batch, index_batch
+
+    def crop_faces(self, frames, mels, coords, indices=None):
+        faces = [
+            cv2.resize(f[y1:y2, x1:x2], (self.img_size, self.img_size))
+            for f, (y1, y2, x1, x2) in zip(frames, coords)
+        ]
+        img_batch, mel_batch = self._prepare_batch(faces, mels)
+        return img_batch, mel_batch, frames, coords, indices
 
-                img_masked = img_batch.copy()
-                img_masked[:, self.img_size // 2 :] = 0
+    def stream_datagen(self, mels, sizer=None):
+        boxes = self.video_face_boxes(limit=len(mels))
+        if sizer is None:
+            sizer = self._wav2lip_sizer()
 
-                img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.0
-                mel_batch = np.reshape(
-                    mel_batch,
-                    [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1],
-                )
+        for frames, mel_batch, coords, _ in self.iter_raw_batches(mels, boxes, sizer):
+            yield self.crop_faces(frames, mel_batch, coords)[:4]
 
-                yield img_batch, mel_batch, frame_batch, coords_batch
-                img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+    def prepare_still(self):
+        # Статичный аватар: одна детекция и один входной тензор лица на все кадры
+        frame = next(self.iter_frames(limit=1), None)
+        if frame is None:
+            raise ValueError("Video contains no frames")
 
-    def _load(self, checkpoint_path):
-        if "cuda" in self.device:
-            checkpoint = torch.load(checkpoint_path)
+        if self.box[0] != -1:
+            y1, y2, x1, x2 = self.box
         else:
-            checkpoint = torch.load(
-                checkpoint_path, map_location=lambda storage, loc: storage
-            )
-        return checkpoint
+            x1, y1, x2, y2 = self.detect_boxes([frame])[0]
+
+        face = cv2.resize(frame[y1:y2, x1:x2], (self.img_size, self.img_size))
+        face_input = torch.FloatTensor(
+            np.transpose(self._face_input([face]), (0, 3, 1, 2))
+        ).to(self.device)
+        return frame, face_input, (y1, y2, x1, x2)
+
+    def iter_still_batches(self, mels, sizer, start=0, end=None):
+        end = len(mels) if end is None else end
+        while start < end:
+            stop = min(start + sizer.size, end)
+            yield mels[start:stop]
+            start = stop
+
+    def still_batch(self, still, mel_batch):
+        frame, face_input, coords = still
+        n = len(mel_batch)
+        # expand не копирует тензор лица; копируются только кадры для вклейки
+        return (
+            face_input.expand(n, -1, -1, -1),
+            self._mel_input(mel_batch),
+            [frame.copy() for _ in range(n)],
+            [coords] * n,
+            [0] * n,
+        )
+
+    def _quantized_dir(self):
+        return self.quantized_dir if self.quantize else None
+
+    def _onnx_options(self):
+        if self.backend == "torch":
+            return None
+        if self.backend != "onnx":
+            raise ValueError("Unknown inference backend: %s" % self.backend)
+        return OnnxOptions(
+            self.onnx_dir, self.ort_intra_op_threads, self.ort_inter_op_threads
+        )
 
     def load_model(self, path):
-        model = Wav2Lip()
-        checkpoint = self._load(path)
-        s = checkpoint["state_dict"]
-        new_s = {}
-        for k, v in s.items():
-            new_s[k.replace("module.", "")] = v
-        model.load_state_dict(new_s)
+        return model_registry.load_wav2lip(path, self.device, self.prepared_dir)
+
+    def warmup(self):
+        model_registry.warmup(
+            self.checkpoint_path,
+            self.device,
+            self.img_size,
+            self._quantized_dir(),
+            self._onnx_options(),
+            self.prepared_dir,
+        )
 
-        model = model.to(self.device)
-        return model.eval()
+    def _forward(self, model, mel, img, indices, features):
+        if features is None or indices is None or not hasattr(model, "encode_face"):
+            return model(mel, img)
+
+        # Энкодер лица запускается только для кадров, которых нет в кеше;
+        # один кадр может встретиться в батче несколько раз
+        cached = [features.get(idx) for idx in indices]
+        missing = {}
+        for pos, (idx, feats) in enumerate(zip(indices, cached)):
+            if feats is None and idx not in missing:
+                missing[idx] = pos
+
+        if missing:
+            encoded = model.encode_face(img[list(missing.values())])
+            computed = {}
+            for k, idx in enumerate(missing):
+                # clone, чтобы запись в кеше не удерживала весь батч признаков
+                computed[idx] = [level[k].clone() for level in encoded]
+                features.put(idx, computed[idx])
+            cached = [
+                feats if feats is not None else computed[idx]
+                for idx, feats in zip(indices, cached)
+            ]
+
+        feats = [
+            torch.stack([frame_feats[level] for frame_feats in cached])
+            for level in range(len(cached[0]))
+        ]
+        return model.decode(mel, feats)
 
-    def generate(self):
-        mel_chunks = self.process_audio()
-        full_frames = self.process_video()
-        full_frames = full_frames[: len(mel_chunks)]
-
-        gen = self.datagen(full_frames.copy(), mel_chunks)
-        for i, (img_batch, mel_batch, frames, coords) in enumerate(gen):
-            if i == 0:
-                model = self.load_model(self.checkpoint_path)
-
-                frame_h, frame_w = full_frames[0].shape[:-1]
-                out = cv2.VideoWriter(
-                    os.path.join(self.temp_dir, "result.avi"),
-                    cv2.VideoWriter_fourcc(*"DIVX"),
-                    self.fps,
-                    (frame_w, frame_h),
+    def _infer(self, model, img_batch, mel_batch, sizer, indices=None, features=None):
+        try:
+            if isinstance(img_batch, torch.Tensor):
+                img = img_batch
+            else:
+                img = torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(
+                    self.device
                 )
-            img_batch = torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(
-                self.device
-            )
-            mel_batch = torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(
+            mel = torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(
                 self.device
             )
 
             with torch.no_grad():
-                pred = model(mel_batch, img_batch)
+                pred = self._forward(model, mel, img, indices, features)
+
+            return pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.0
+        except RuntimeError:
+            # Нехватка памяти: уменьшаем батч для следующих итераций и
+            # досчитываем текущий по половинам
+            if len(img_batch) == 1:
+                raise
+            sizer.shrink()
+            if "cuda" in self.device:
+                torch.cuda.empty_cache()
+            half = len(img_batch) // 2
+            head = tail = None
+            if indices is not None:
+                head, tail = indices[:half], indices[half:]
+            return np.concatenate(
+                [
+                    self._infer(
+                        model, img_batch[:half], mel_batch[:half], sizer, head, features
+                    ),
+                    self._infer(
+                        model, img_batch[half:], mel_batch[half:], sizer, tail, features
+                    ),
+                ]
+            )
+
+    def silence_mask(self, mel_chunks, mode=None):
+        mode = self.silence_mode if mode is None else mode
+        if mode == "off":
+            return None
+        if mode not in ("passthrough", "cached"):
+            raise ValueError("Unknown silence mode: %s" % mode)
+        return audio.silent_frames(
+            mel_chunks,
+            self.silence_threshold_db,
+            self.silence_min_frames,
+            self.silence_margin,
+        )
 
-            pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.0
+    def paste_back(self, pred, frames, coords):
+        for p, f, c in zip(pred, frames, coords):
+            if p is None:
+                # Пауза в режиме passthrough: кадр остается исходным
+                continue
+            y1, y2, x1, x2 = c
+            p = cv2.resize(p.astype(np.uint8), (x2 - x1, y2 - y1))
+
+            f[y1:y2, x1:x2] = p
+        return frames
+
+    def generate(self):
+        mel_chunks = self.process_audio()
 
-            for p, f, c in zip(pred, frames, coords):
-                y1, y2, x1, x2 = c
-                p = cv2.resize(p.astype(np.uint8), (x2 - x1, y2 - y1))
+        if self.is_still():
+            boxes = None
+        else:
+            boxes = self.video_face_boxes(limit=len(mel_chunks))
 
-                f[y1:y2, x1:x2] = p
+        segments = self.segment_ranges(len(mel_chunks))
+        if len(segments) > 1:
+            self.render_segments(mel_chunks, boxes, segments)
+        else:
+            self.render(mel_chunks, boxes, self.output_path, self.audio_path)
+
+    def segment_ranges(self, total):
+        n = max(1, min(self.segments, total // MIN_SEGMENT_FRAMES))
+        bounds = np.linspace(0, total, n + 1).astype(int)
+        return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def render_segments(self, mel_chunks, boxes, segments):
+        # Мел и боксы считаются и сглаживаются один раз для всего ролика, поэтому
+        # сегментам не нужны перекрытия: кадры на стыках те же, что и без деления
+        settings = {
+            k: v for k, v in vars(self).items() if k != "run_info" and not callable(v)
+        }
+        if boxes is None and self.box[0] == -1:
+            # Статичный аватар: лицо ищется один раз здесь, а не в каждом процессе
+            settings["box"] = list(self.prepare_still()[2])
+
+        workers = min(self.segment_workers or len(segments), len(segments))
+        threads = max(1, torch.get_num_threads() // workers)
+        settings["encoder_threads"] = self.encoder_threads or threads
+        settings["ort_intra_op_threads"] = self.ort_intra_op_threads or threads
+
+        os.makedirs(self.temp_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix="segments_", dir=self.temp_dir)
+        try:
+            mel_path = os.path.join(work_dir, "mel.npy")
+            np.save(mel_path, mel_chunks.mel)
+            boxes_path = None
+            if boxes is not None:
+                boxes_path = os.path.join(work_dir, "boxes.npy")
+                np.save(boxes_path, boxes)
+            paths = [
+                os.path.join(work_dir, f"segment_{i:04d}.mp4")
+                for i in range(len(segments))
+            ]
+
+            # spawn: у каждого процесса свой CUDA-контекст и свои пулы потоков
+            with ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_segment_worker,
+                initargs=(threads,),
+            ) as pool:
+                futures = [
+                    pool.submit(
+                        _render_segment, settings, mel_path, boxes_path, start, end, path
+                    )
+                    for (start, end), path in zip(segments, paths)
+                ]
+                try:
+                    infos = [future.result() for future in futures]
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            # Сегменты сшиваются без перекодирования, звук добавляется тем же вызовом
+            concat_segments(paths, self.output_path, self.audio_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        self.run_info["wav2lip_batch_size"] = infos[0]["wav2lip_batch_size"]
+        self.run_info["still"] = self.is_still()
+        self.run_info["segment_workers"] = workers
+        self.run_info["segments"] = infos
+
+    def loops(self, boxes, n_frames):
+        # Номера исходных кадров повторяются: фото или видео короче аудио
+        return n_frames > (1 if boxes is None else len(boxes))
+
+    def use_feature_cache(self, boxes, n_frames):
+        # Кеш окупается, только если кадры повторяются и весь цикл помещается
+        # в бюджет; иначе каждый поиск - промах и лишнее копирование
+        loop_len = 1 if boxes is None else len(boxes)
+        return (
+            self.loops(boxes, n_frames)
+            and loop_len * FACE_FEATURE_BYTES <= self.face_feature_cache_size
+        )
+
+    def render_silence_mode(self, boxes, n_frames):
+        # cached экономит инференс только на повторяющихся кадрах; без повторов
+        # каждая пауза все равно прогоняется через сеть, но уже с мелом тишины,
+        # поэтому такой рендер идет без пропуска пауз
+        if self.silence_mode == "cached" and not self.loops(boxes, n_frames):
+            return "off"
+        return self.silence_mode
+
+    def render(self, mel_chunks, boxes, output_path, audio_path, start=0, end=None):
+        """Renders frames ``[start, end)`` of the result into ``output_path``;
+        ``boxes`` is None for a still avatar. Without ``audio_path`` the file
+        has only the video track."""
+        end = len(mel_chunks) if end is None else end
+        if end <= start:
+            raise ValueError("Audio is too short: no mel chunks to render")
+        if boxes is not None and len(boxes) == 0:
+            raise ValueError("Video contains no frames")
+
+        sizer = self._wav2lip_sizer()
+        if boxes is None:
+            still = self.prepare_still()
+            batches = self.iter_still_batches(mel_chunks, sizer, start, end)
+            prepare_batch = lambda b: self.still_batch(still, b)
+        else:
+            batches = self.iter_raw_batches(mel_chunks, boxes, sizer, start, end)
+            prepare_batch = lambda b: self.crop_faces(*b)
+        # Номер первого кадра батча нужен для маски пауз
+        source = _numbered(batches, start)
+        prepare = lambda item: (item[0], prepare_batch(item[1]))
+        loading = time.perf_counter()
+        model = model_registry.get_wav2lip(
+            self.checkpoint_path,
+            self.device,
+            self._quantized_dir(),
+            self._onnx_options(),
+            self.prepared_dir,
+        )
+        # Почти 0, если модель уже загружена при прогреве воркера
+        self.run_info["model_load_s"] = round(time.perf_counter() - loading, 3)
+        features = None
+        if self.use_feature_cache(boxes, end - start):
+            features = FaceFeatureCache(self.face_feature_cache_size)
+        out = None
+
+        silence_mode = self.render_silence_mode(boxes, end - start)
+        silence = self.silence_mask(mel_chunks, silence_mode)
+        silent_preds = None
+        if silence_mode == "cached":
+            silent_preds = FaceFeatureCache(self.silence_cache_size)
+        skipped = 0
+
+        def run(img_batch, mel_batch, indices):
+            start = time.perf_counter()
+            pred = self._infer(model, img_batch, mel_batch, sizer, indices, features)
+            sizer.report(len(pred), time.perf_counter() - start)
+            return pred
+
+        def infer_silent(img_batch, mel_batch, indices, silent):
+            nonlocal skipped
+            pred = [None] * len(silent)
+            speech = np.flatnonzero(~silent)
+            if len(speech):
+                inferred = run(
+                    img_batch[speech], mel_batch[speech], [indices[k] for k in speech]
+                )
+                for k, p in zip(speech, inferred):
+                    pred[k] = p
+            skipped += len(silent) - len(speech)
+            if silent_preds is None:
+                return pred
+
+            # Для полной тишины все мел-окна одинаковы, поэтому предсказание
+            # зависит только от кадра и считается один раз на номер кадра
+            missing = {}
+            for k in np.flatnonzero(silent):
+                cached = silent_preds.get(indices[k])
+                if cached is None:
+                    missing.setdefault(indices[k], []).append(k)
+                else:
+                    pred[k] = cached[0].numpy()
+            if missing:
+                first = [ks[0] for ks in missing.values()]
+                quiet = np.full_like(mel_batch[first], audio.silent_level())
+                inferred = run(img_batch[first], quiet, list(missing))
+                skipped -= len(first)
+                for (idx, ks), p in zip(missing.items(), inferred):
+                    p = p.astype(np.uint8)
+                    silent_preds.put(idx, [torch.from_numpy(p)])
+                    for k in ks:
+                        pred[k] = p
+            return pred
+
+        def infer(item):
+            pos, (img_batch, mel_batch, frames, coords, indices) = item
+            silent = None
+            if silence is not None:
+                silent = silence[pos : pos + len(frames)]
+            if silent is None or not silent.any():
+                return run(img_batch, mel_batch, indices), frames, coords
+            return infer_silent(img_batch, mel_batch, indices, silent), frames, coords
+
+        def encode(frames):
+            nonlocal out
+            if out is None:
+                frame_h, frame_w = frames[0].shape[:-1]
+                out = FFmpegWriter(
+                    output_path,
+                    self.fps,
+                    (frame_w, frame_h),
+                    audio_path=audio_path,
+                    preset=self.x264_preset,
+                    crf=self.x264_crf,
+                    threads=self.encoder_threads,
+                )
+            for f in frames:
                 out.write(f)
-        out.release()
-        command = "ffmpeg -y -i {} -i {} -strict -2 -q:v 1 {}".format(
-            self.audio_path,
-            os.path.join(self.temp_dir, "result.avi"),
-            self.output_path,
+
+        # Чтение кадров, подготовка батчей, инференс, вклейка и запись идут
+        # в разных потоках; порядок кадров восстанавливается перед записью
+        workers = self.pipeline_workers
+        pipeline = Pipeline(
+            [
+                Stage("prepare", prepare, workers.get("prepare", 1)),
+                Stage("infer", infer),
+                Stage("paste", lambda b: self.paste_back(*b), workers.get("paste", 1)),
+                Stage("encode", encode, ordered=True),
+            ],
+            queue_size=self.pipeline_queue_size,
         )
-        subprocess.call(command, shell=platform.system() != "Windows")
+        try:
+            stats = pipeline.run(source)
+        except BaseException:
+            if out is not None:
+                out.abort()
+            raise
+        if out is None:
+            raise ValueError("Could not read frames from %s" % self.video_path)
+        # Кодирование и сведение со звуком идут в одном процессе ffmpeg
+        out.close()
+
+        self.run_info["wav2lip_batch_size"] = sizer.size
+        self.run_info["still"] = self.is_still()
+        if features is not None:
+            self.run_info["face_feature_cache"] = {
+                "hits": features.hits,
+                "misses": features.misses,
+            }
+        if silence is not None:
+            self.run_info["silence"] = {
+                "mode": silence_mode,
+                "frames": int(silence[start:end].sum()),
+                "skipped_inference": skipped,
+            }
+        elif silence_mode != self.silence_mode:
+            self.run_info["silence"] = {"mode": silence_mode, "requested": self.silence_mode}
+        self.run_info["pipeline"] = stats
@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+
+import numpy as np
+import torch
+
+from Wav2Lip import weights
+from Wav2Lip.face_detection.api import FaceAlignment, LandmarksType
+from Wav2Lip.models.wav2lip import Wav2Lip
+
+logger = logging.getLogger(__name__)
+
+# Модели загружаются один раз на процесс и переиспользуются всеми задачами
+_lock = threading.RLock()
+_face_detectors = {}
+_wav2lip_models = {}
+
+
+def _load_checkpoint(checkpoint_path, device):
+    if "cuda" in device:
+        return torch.load(checkpoint_path)
+    return torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+
+
+def _prepared_path(prepared_dir, name, *args):
+    if not prepared_dir:
+        return None
+    from Wav2Lip import prepare_models
+
+    path = getattr(prepare_models, name + "_path")(prepared_dir, *args)
+    if not os.path.isfile(path):
+        logger.info("Подготовленные веса %s не найдены в %s", name, prepared_dir)
+        return None
+    return path
+
+
+def load_wav2lip(checkpoint_path, device, prepared_dir=None):
+    path = _prepared_path(prepared_dir, "wav2lip", checkpoint_path)
+    if path is not None:
+        return weights.build(Wav2Lip, weights.load_weights(path), device)
+
+    model = Wav2Lip()
+    checkpoint = _load_checkpoint(checkpoint_path, device)
+    s = checkpoint["state_dict"]
+    new_s = {}
+    for k, v in s.items():
+        new_s[k.replace("module.", "")] = v
+    model.load_state_dict(new_s)
+
+    model = model.to(device)
+    return model.eval()
+
+
+def _use_quantized(quantized_dir, device):
+    # INT8-модели есть только для CPU
+    return bool(quantized_dir) and device == "cpu"
+
+
+def _onnx_s3fd_kwargs(onnx):
+    from Wav2Lip import onnx_backend
+
+    path = onnx_backend.s3fd_path(onnx.model_dir)
+    if not os.path.isfile(path):
+        logger.warning("ONNX-модель S3FD не найдена в %s, используется torch", onnx.model_dir)
+        return None
+    return {
+        "backend": "onnx",
+        "onnx_path": path,
+        "intra_op_threads": onnx.intra_op_threads,
+        "inter_op_threads": onnx.inter_op_threads,
+    }
+
+
+def _s3fd_kwargs(onnx, prepared_dir):
+    if onnx:
+        return _onnx_s3fd_kwargs(onnx)
+    path = _prepared_path(prepared_dir, "s3fd")
+    return {"path_to_detector": path} if path else None
+
+
+def get_face_detector(device, quantized_dir=None, onnx=None, prepared_dir=None):
+    quantized = onnx is None and _use_quantized(quantized_dir, device)
+    key = (device, quantized_dir if quantized else None, onnx, prepared_dir)
+    with _lock:
+        detector = _face_detectors.get(key)
+        if detector is None:
+            detector = FaceAlignment(
+                LandmarksType._2D,
+                flip_input=False,
+                device=device,
+                face_detector_kwargs=_s3fd_kwargs(onnx, prepared_dir),
+            )
+            if quantized:
+                from Wav2Lip import quantization
+
+                net = quantization.load_s3fd(quantized_dir)
+                if net is None:
+                    logger.warning(
+                        "Квантованный S3FD не найден в %s, используется fp32", quantized_dir
+                    )
+                else:
+                    detector.face_detector.face_detector = net
+            _face_detectors[key] = detector
+        return detector
+
+
+def get_wav2lip(checkpoint_path, device, quantized_dir=None, onnx=None, prepared_dir=None):
+    quantized = onnx is None and _use_quantized(quantized_dir, device)
+    key = (checkpoint_path, device, quantized_dir if quantized else None, onnx, prepared_dir)
+    with _lock:
+        model = _wav2lip_models.get(key)
+        if model is None:
+            if onnx is not None:
+                from Wav2Lip import onnx_backend
+
+                model = onnx_backend.load_wav2lip(onnx, checkpoint_path, device)
+                if model is None:
+                    logger.warning(
+                        "ONNX-модель Wav2Lip не найдена в %s, используется torch", onnx.model_dir
+                    )
+            elif quantized:
+                from Wav2Lip import quantization
+
+                model = quantization.load_wav2lip(quantized_dir, checkpoint_path)
+                if model is None:
+                    logger.warning(
+                        "Квантованный Wav2Lip не найден в %s, используется fp32", quantized_dir
+                    )
+            if model is None:
+                model = load_wav2lip(checkpoint_path, device, prepared_dir)
+            _wav2lip_models[key] = model
+        return model
+
+
+def warmup(checkpoint_path, device, img_size=96, quantized_dir=None, onnx=None, prepared_dir=None):
+    detector = get_face_detector(device, quantized_dir, onnx, prepared_dir)
+    detector.get_detections_for_batch(np.zeros((1, 128, 128, 3), dtype=np.uint8))
+
+    model = get_wav2lip(checkpoint_path, device, quantized_dir, onnx, prepared_dir)
+    with torch.no_grad():
+        model(
+            torch.zeros((1, 1, 80, 16), device=device),
+            torch.zeros((1, 6, img_size, img_size), device=device),
+        )
+
+
+def clear():
+    with _lock:
+        _face_detectors.clear()
+        _wav2lip_models.clear()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
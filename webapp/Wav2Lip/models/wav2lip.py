@@ -130,14 +130,31 @@ class Wav2Lip(nn.Module):
                 [face_sequences[:, :, i] for i in range(face_sequences.size(2))], dim=0
             )
 
-        audio_embedding = self.audio_encoder(audio_sequences)  # B, 512, 1, 1
+        feats = self.encode_face(face_sequences)
+        x = self.decode(audio_sequences, feats)
+
+        if input_dim_size > 4:
+            x = torch.split(x, B, dim=0)  # [(B, C, H, W)]
+            outputs = torch.stack(x, dim=2)  # (B, C, T, H, W)
 
+        else:
+            outputs = x
+
+        return outputs
+
+    def encode_face(self, face_sequences):
+        # Признаки лица не зависят от аудио и могут переиспользоваться
         feats = []
         x = face_sequences
         for f in self.face_encoder_blocks:
             x = f(x)
             feats.append(x)
+        return feats
 
+    def decode(self, audio_sequences, feats):
+        audio_embedding = self.audio_encoder(audio_sequences)  # B, 512, 1, 1
+
+        feats = list(feats)
         x = audio_embedding
         for f in self.face_decoder_blocks:
             x = f(x)
@@ -150,16 +167,7 @@ class Wav2Lip(nn.Module):
 
             feats.pop()
 
-        x = self.output_block(x)
-
-        if input_dim_size > 4:
-            x = torch.split(x, B, dim=0)  # [(B, C, H, W)]
-            outputs = torch.stack(x, dim=2)  # (B, C, T, H, W)
-
-        else:
-            outputs = x
-
-        return outputs
+        return self.output_block(x)
 
 
 class Wav2Lip_disc_qual(nn.Module):
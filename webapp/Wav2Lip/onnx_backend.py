@@ -0,0 +1,208 @@
+"""
+Экспорт Wav2Lip и S3FD в ONNX и инференс через ONNX Runtime
+
+Использование (из каталога webapp):
+    python -m Wav2Lip.onnx_backend [--checkpoint checkpoints/wav2lip_gan.pth] [--out-dir cache/onnx]
+"""
+
+import argparse
+import inspect
+import logging
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+import torch
+
+from Wav2Lip.cache import file_digest, make_key
+from Wav2Lip.quantization import Decoder, FaceEncoder
+from Wav2Lip.weights import S3FD_PATH, S3FD_URL
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при изменении схемы экспорта, чтобы не загружать старые файлы
+ONNX_EXPORT_VERSION = 1
+OPSET = 17
+
+# Каталог с экспортированными моделями и число потоков ONNX Runtime
+# (0 - значение по умолчанию ONNX Runtime); хешируется как ключ реестра моделей
+OnnxOptions = namedtuple(
+    "OnnxOptions", ["model_dir", "intra_op_threads", "inter_op_threads"]
+)
+
+FEATURE_NAMES = [f"feat{i}" for i in range(7)]
+
+
+def _artifact_path(model_dir, name, source):
+    key = make_key(name, ONNX_EXPORT_VERSION, OPSET, source)
+    return os.path.join(model_dir, f"{name}_{key[:16]}")
+
+
+def wav2lip_paths(model_dir, checkpoint_path):
+    base = _artifact_path(model_dir, "wav2lip", file_digest(checkpoint_path))
+    return base + "_encoder.onnx", base + "_decoder.onnx"
+
+
+def s3fd_path(model_dir):
+    source = file_digest(S3FD_PATH) if os.path.isfile(S3FD_PATH) else S3FD_URL
+    return _artifact_path(model_dir, "s3fd", source) + ".onnx"
+
+
+def _export(module, args, path, input_names, output_names, dynamic_axes):
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Новые версии torch по умолчанию используют экспорт через dynamo
+        kwargs["dynamo"] = False
+
+    tmp_path = path + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            module.eval(),
+            args,
+            tmp_path,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=OPSET,
+            **kwargs,
+        )
+    os.replace(tmp_path, path)
+
+
+def export_wav2lip(model, model_dir, checkpoint_path, img_size=96):
+    """Exports the face encoder and the audio encoder + decoder as two ONNX
+    graphs with a dynamic batch axis, keeping encode_face/decode separate."""
+    os.makedirs(model_dir, exist_ok=True)
+    encoder_path, decoder_path = wav2lip_paths(model_dir, checkpoint_path)
+    model = model.cpu().eval()
+    encoder, decoder = FaceEncoder(model), Decoder(model)
+
+    faces = torch.zeros((2, 6, img_size, img_size))
+    mel = torch.zeros((2, 1, 80, 16))
+    batch = {0: "batch"}
+
+    _export(
+        encoder, (faces,), encoder_path, ["faces"], FEATURE_NAMES,
+        {name: batch for name in ["faces"] + FEATURE_NAMES},
+    )
+    with torch.no_grad():
+        feats = encoder(faces)
+    _export(
+        decoder, (mel,) + feats, decoder_path, ["mel"] + FEATURE_NAMES, ["pred"],
+        {name: batch for name in ["mel", "pred"] + FEATURE_NAMES},
+    )
+    return encoder_path, decoder_path
+
+
+def export_s3fd(net, model_dir):
+    """Exports S3FD with dynamic batch, height and width."""
+    os.makedirs(model_dir, exist_ok=True)
+    path = s3fd_path(model_dir)
+    outputs = [f"{kind}{i}" for i in range(1, 7) for kind in ("cls", "reg")]
+    axes = {0: "batch", 2: "height", 3: "width"}
+    _export(
+        net.cpu(), (torch.zeros((1, 3, 256, 256)),), path, ["images"], outputs,
+        {name: axes for name in ["images"] + outputs},
+    )
+    return path
+
+
+def make_session(path, intra_op_threads=0, inter_op_threads=0, device="cpu"):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    if inter_op_threads > 1:
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+    providers = ["CPUExecutionProvider"]
+    if "cuda" in device and "CUDAExecutionProvider" in ort.get_available_providers():
+        providers.insert(0, "CUDAExecutionProvider")
+    return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+
+def _numpy(tensor):
+    return tensor.detach().cpu().numpy().astype(np.float32, copy=False)
+
+
+class OnnxWav2Lip:
+    """Wav2Lip running in ONNX Runtime with the torch model's ``encode_face`` /
+    ``decode`` / call interface; takes and returns torch tensors."""
+
+    def __init__(self, encoder_path, decoder_path, intra_op_threads=0, inter_op_threads=0, device="cpu"):
+        self.encoder = make_session(encoder_path, intra_op_threads, inter_op_threads, device)
+        self.decoder = make_session(decoder_path, intra_op_threads, inter_op_threads, device)
+
+    def encode_face(self, face_sequences):
+        feats = self.encoder.run(None, {"faces": _numpy(face_sequences)})
+        return [torch.from_numpy(f) for f in feats]
+
+    def decode(self, audio_sequences, feats):
+        inputs = {"mel": _numpy(audio_sequences)}
+        inputs.update((name, _numpy(f)) for name, f in zip(FEATURE_NAMES, feats))
+        return torch.from_numpy(self.decoder.run(None, inputs)[0])
+
+    def __call__(self, audio_sequences, face_sequences):
+        return self.decode(audio_sequences, self.encode_face(face_sequences))
+
+
+class OnnxS3FD:
+    """S3FD running in ONNX Runtime; returns the same list of 12 tensors as
+    ``net_s3fd.s3fd`` so the regular box decoding can be used."""
+
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0, device="cpu"):
+        self.session = make_session(path, intra_op_threads, inter_op_threads, device)
+
+    def __call__(self, images):
+        outputs = self.session.run(None, {"images": _numpy(images)})
+        return [torch.from_numpy(o) for o in outputs]
+
+    # SFDDetector вызывает to()/eval() у сети; для сессии это не требуется
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+
+def load_wav2lip(options, checkpoint_path, device="cpu"):
+    """ONNX Wav2Lip for ``OnnxOptions``, or None if it was not exported."""
+    encoder_path, decoder_path = wav2lip_paths(options.model_dir, checkpoint_path)
+    if not (os.path.isfile(encoder_path) and os.path.isfile(decoder_path)):
+        return None
+    return OnnxWav2Lip(
+        encoder_path, decoder_path,
+        options.intra_op_threads, options.inter_op_threads, device,
+    )
+
+
+def main():
+    from Wav2Lip import model_registry
+    from Wav2Lip.interface import Wav2LipInterface
+
+    defaults = Wav2LipInterface(None, None)
+    parser = argparse.ArgumentParser(description="Экспорт Wav2Lip и S3FD в ONNX")
+    parser.add_argument("--checkpoint", default=defaults.checkpoint_path, help="Чекпоинт Wav2Lip")
+    parser.add_argument("--out-dir", default=os.environ.get(
+        "WAV2LIP_ONNX_DIR",
+        os.path.join(os.environ.get("WAV2LIP_CACHE_DIR", "cache"), "onnx"),
+    ), help="Каталог для ONNX-моделей")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    model = model_registry.load_wav2lip(args.checkpoint, "cpu")
+    for path in export_wav2lip(model, args.out_dir, args.checkpoint, defaults.img_size):
+        print(f"Wav2Lip: {path}")
+
+    net = model_registry.get_face_detector("cpu").face_detector.face_detector
+    print(f"S3FD: {export_s3fd(net, args.out_dir)}")
+    print("Сверка с torch и замер скорости: python benchmarks/bench_onnx.py")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
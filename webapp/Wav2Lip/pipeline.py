@@ -0,0 +1,211 @@
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class Stage:
+    """One step of a Pipeline: ``fn(item)`` run by ``workers`` threads.
+
+    Stages with several workers may finish items out of order; an ``ordered``
+    stage (single worker) receives them back in source order.
+    """
+
+    def __init__(self, name, fn, workers=1, ordered=False):
+        if ordered and workers != 1:
+            raise ValueError("Ordered stage must have exactly one worker")
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.ordered = ordered
+
+        self._lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.0
+        self.input_wait = 0.0
+        self.output_wait = 0.0
+
+    def _account(self, busy=0.0, input_wait=0.0, output_wait=0.0, items=0):
+        with self._lock:
+            self.busy += busy
+            self.input_wait += input_wait
+            self.output_wait += output_wait
+            self.items += items
+
+    def stats(self, wall_time):
+        # utilization - доля времени, которую потоки стадии были заняты работой;
+        # узкое место - стадия с utilization около 1, у остальных растет ожидание входа
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "busy_s": round(self.busy, 3),
+            "input_wait_s": round(self.input_wait, 3),
+            "output_wait_s": round(self.output_wait, 3),
+            "utilization": round(
+                self.busy / max(wall_time * self.workers, 1e-9), 3
+            ),
+        }
+
+
+class Pipeline:
+    """Runs a source iterator and a chain of stages on threads connected by
+    bounded queues, so decoding, preprocessing, inference and encoding overlap.
+
+    The queues hold at most ``queue_size`` items each, which bounds memory and
+    makes a slow stage back-pressure the ones before it. The first exception
+    raised by any stage stops the pipeline and is re-raised from ``run()``.
+    """
+
+    def __init__(self, stages, queue_size=2, source_name="decode"):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.source = Stage(source_name, None)
+        self.wall_time = 0.0
+
+    def stats(self):
+        return {
+            stage.name: stage.stats(self.wall_time)
+            for stage in [self.source] + self.stages
+        }
+
+    def run(self, source):
+        self._stop = threading.Event()
+        self._error = None
+        self._error_lock = threading.Lock()
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [
+            threading.Thread(
+                target=self._guard,
+                args=(self._produce, source, queues[0], self.stages[0].workers),
+                name=f"pipeline-{self.source.name}",
+                daemon=True,
+            )
+        ]
+
+        for i, stage in enumerate(self.stages):
+            out_q = queues[i + 1] if i + 1 < len(self.stages) else None
+            downstream = self.stages[i + 1].workers if out_q is not None else 0
+            remaining = [stage.workers]
+            for n in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._guard,
+                        args=(
+                            self._work,
+                            stage,
+                            queues[i],
+                            out_q,
+                            downstream,
+                            remaining,
+                        ),
+                        name=f"pipeline-{stage.name}-{n}",
+                        daemon=True,
+                    )
+                )
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wall_time = time.perf_counter() - start
+
+        if self._error is not None:
+            raise self._error
+        return self.stats()
+
+    def _guard(self, target, *args):
+        try:
+            target(*args)
+        except BaseException as e:
+            with self._error_lock:
+                if self._error is None:
+                    self._error = e
+            self._stop.set()
+
+    def _put(self, q, item, stage):
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            stage._account(output_wait=time.perf_counter() - start)
+
+    def _get(self, q, stage):
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _DONE
+        finally:
+            stage._account(input_wait=time.perf_counter() - start)
+
+    def _produce(self, source, out_q, downstream):
+        iterator = iter(source)
+        try:
+            seq = 0
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.source._account(busy=time.perf_counter() - start, items=1)
+
+                if not self._put(out_q, (seq, item), self.source):
+                    return
+                seq += 1
+
+            for _ in range(downstream):
+                if not self._put(out_q, _DONE, self.source):
+                    return
+        finally:
+            # Закрываем генератор, чтобы освободить VideoCapture при ошибке
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def _work(self, stage, in_q, out_q, downstream, remaining):
+        pending = {}
+        next_seq = 0
+
+        while True:
+            entry = self._get(in_q, stage)
+            if entry is _DONE:
+                break
+
+            if stage.ordered:
+                pending[entry[0]] = entry[1]
+                while next_seq in pending:
+                    self._process(stage, next_seq, pending.pop(next_seq), out_q)
+                    next_seq += 1
+            else:
+                self._process(stage, entry[0], entry[1], out_q)
+
+        if self._stop.is_set():
+            return
+
+        with stage._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and out_q is not None:
+            for _ in range(downstream):
+                if not self._put(out_q, _DONE, stage):
+                    return
+
+    def _process(self, stage, seq, item, out_q):
+        start = time.perf_counter()
+        result = stage.fn(item)
+        stage._account(busy=time.perf_counter() - start, items=1)
+        if out_q is not None:
+            self._put(out_q, (seq, result), stage)
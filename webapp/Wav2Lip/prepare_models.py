@@ -0,0 +1,167 @@
+"""
+Подготовка весов Wav2Lip и S3FD для быстрого старта воркеров
+
+Из GAN-чекпоинта остается только state_dict генератора (без оптимизатора и
+префикса ``module.``), веса S3FD сохраняются локально, чтобы воркер не скачивал
+их при старте. С torch >= 2.1 файлы загружаются через ``torch.load(mmap=True)``:
+тензоры отображаются в память, а не читаются и копируются целиком; на более
+старом torch они читаются обычным ``torch.load`` (см. weights.load_weights).
+
+Использование (из каталога webapp):
+    python -m Wav2Lip.prepare_models [--checkpoint checkpoints/wav2lip_gan.pth] [--out-dir cache/prepared]
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import torch
+
+from Wav2Lip.cache import make_key
+from Wav2Lip.weights import S3FD_PATH, S3FD_URL
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при изменении формата файлов, чтобы не загружать старые
+PREPARED_VERSION = 1
+
+CHECKPOINT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "checkpoints", "wav2lip_gan.pth"
+)
+
+
+def _source_key(path):
+    # Ключ по пути, размеру и времени изменения: хеш большого чекпоинта
+    # занял бы больше времени, чем сама загрузка подготовленных весов
+    stat = os.stat(path)
+    return make_key(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def _artifact_path(model_dir, name, source):
+    key = make_key(name, PREPARED_VERSION, source)
+    return os.path.join(model_dir, f"{name}_{key[:16]}.pt")
+
+
+def wav2lip_path(model_dir, checkpoint_path):
+    return _artifact_path(model_dir, "wav2lip", _source_key(checkpoint_path))
+
+
+def s3fd_path(model_dir):
+    source = _source_key(S3FD_PATH) if os.path.isfile(S3FD_PATH) else S3FD_URL
+    return _artifact_path(model_dir, "s3fd", source)
+
+
+def strip_state_dict(state_dict):
+    return {
+        k.replace("module.", ""): v.detach().float().contiguous()
+        if v.is_floating_point() else v.detach().contiguous()
+        for k, v in state_dict.items()
+    }
+
+
+def _save(state_dict, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    torch.save(state_dict, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def prepare_wav2lip(checkpoint_path, model_dir):
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    state_dict = checkpoint.get("state_dict", checkpoint)
+    return _save(strip_state_dict(state_dict), wav2lip_path(model_dir, checkpoint_path))
+
+
+def prepare_s3fd(model_dir):
+    if os.path.isfile(S3FD_PATH):
+        state_dict = torch.load(S3FD_PATH, map_location="cpu")
+    else:
+        from torch.utils.model_zoo import load_url
+
+        state_dict = load_url(S3FD_URL, map_location="cpu")
+    return _save(strip_state_dict(state_dict), s3fd_path(model_dir))
+
+
+def measure_cold_start(checkpoint_path, prepared_dir, device="cpu", img_size=96):
+    """Loads both models and runs the first forward pass in this process;
+    returns the timings in seconds. Meaningful only in a fresh process."""
+    import numpy as np
+
+    start = time.perf_counter()
+    from Wav2Lip import model_registry
+    timings = {"import": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    detector = model_registry.get_face_detector(device, prepared_dir=prepared_dir)
+    timings["s3fd_load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model = model_registry.get_wav2lip(checkpoint_path, device, prepared_dir=prepared_dir)
+    timings["wav2lip_load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    detector.get_detections_for_batch(np.zeros((1, 128, 128, 3), dtype=np.uint8))
+    with torch.no_grad():
+        model(
+            torch.zeros((1, 1, 80, 16), device=device),
+            torch.zeros((1, 6, img_size, img_size), device=device),
+        )
+    timings["first_forward"] = time.perf_counter() - start
+    timings["total"] = sum(timings.values())
+    return {name: round(value, 3) for name, value in timings.items()}
+
+
+def _cold_start_in_subprocess(checkpoint_path, prepared_dir):
+    command = [sys.executable, "-m", "Wav2Lip.prepare_models", "--measure", "--checkpoint", checkpoint_path]
+    if prepared_dir:
+        command += ["--out-dir", prepared_dir]
+    else:
+        command.append("--original")
+    output = subprocess.run(
+        command, check=True, stdout=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    # Модули Wav2Lip здесь не импортируются: их импорт входит в замер холодного старта
+    parser = argparse.ArgumentParser(description="Подготовка весов Wav2Lip и S3FD")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Чекпоинт Wav2Lip")
+    parser.add_argument("--out-dir", default=os.environ.get(
+        "WAV2LIP_PREPARED_DIR",
+        os.path.join(os.environ.get("WAV2LIP_CACHE_DIR", "cache"), "prepared"),
+    ), help="Каталог для подготовленных весов")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--original", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        # Замер в отдельном процессе, запущенном из main(): печатает JSON
+        prepared_dir = None if args.original else args.out_dir
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(json.dumps(measure_cold_start(args.checkpoint, prepared_dir, device)))
+        return 0
+
+    logging.basicConfig(level=logging.INFO)
+    # Замеры запускаются из каталога webapp
+    args.checkpoint = os.path.abspath(args.checkpoint)
+    args.out_dir = os.path.abspath(args.out_dir)
+
+    print(f"Wav2Lip: {prepare_wav2lip(args.checkpoint, args.out_dir)}")
+    print(f"S3FD: {prepare_s3fd(args.out_dir)}")
+
+    print("Холодный старт (загрузка моделей и первый прогон), с:")
+    for name, prepared_dir in (("исходные", None), ("подготовленные", args.out_dir)):
+        timings = _cold_start_in_subprocess(args.checkpoint, prepared_dir)
+        print(f"  {name:>15}: " + ", ".join(f"{k}={v}" for k, v in timings.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""
+Статическая INT8-квантизация Wav2Lip и S3FD для CPU
+
+Калибровка на реальном видео и аудио, проверка качества относительно fp32,
+отчет о скорости и сохранение квантованных моделей в кеш на диске.
+
+Использование (из каталога webapp):
+    python -m Wav2Lip.quantization --video avatar.mp4 --audio speech.mp3 [--out-dir cache/quantized]
+"""
+
+import argparse
+import copy
+import logging
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import torch
+from torch import nn
+
+from Wav2Lip.cache import file_digest, make_key
+from Wav2Lip.weights import S3FD_PATH, S3FD_URL
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при изменении схемы квантизации, чтобы не загружать старые файлы
+QUANTIZATION_VERSION = 2
+
+# Пороги проверки качества относительно fp32
+MIN_PSNR = 30.0  # дБ по выходу Wav2Lip (кадр 96x96)
+MIN_IOU = 0.9  # средний IoU лучшего бокса S3FD
+
+
+def quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError("No quantized engine is available in this torch build")
+
+
+class FaceEncoder(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.face_encoder_blocks = model.face_encoder_blocks
+
+    def forward(self, x):
+        feats = []
+        for f in self.face_encoder_blocks:
+            x = f(x)
+            feats.append(x)
+        return tuple(feats)
+
+
+class Decoder(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.audio_encoder = model.audio_encoder
+        self.face_decoder_blocks = model.face_decoder_blocks
+        self.output_block = model.output_block
+
+    def forward(self, audio_sequences, f0, f1, f2, f3, f4, f5, f6):
+        feats = [f0, f1, f2, f3, f4, f5, f6]
+        x = self.audio_encoder(audio_sequences)
+        for f in self.face_decoder_blocks:
+            x = f(x)
+            x = torch.cat((x, feats[-1]), dim=1)
+            feats.pop()
+        return self.output_block(x)
+
+
+class QuantizedWav2Lip(nn.Module):
+    """INT8 Wav2Lip with the same ``encode_face`` / ``decode`` / ``forward``
+    interface as the fp32 model, so the face feature cache keeps working."""
+
+    def __init__(self, encoder, decoder):
+        super().__init__()
+        self.encoder = encoder
+        self.decoder = decoder
+
+    def encode_face(self, face_sequences):
+        return list(self.encoder(face_sequences))
+
+    def decode(self, audio_sequences, feats):
+        return self.decoder(audio_sequences, *feats)
+
+    def forward(self, audio_sequences, face_sequences):
+        return self.decode(audio_sequences, self.encode_face(face_sequences))
+
+
+def _quantize(module, example_inputs, calibration):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = quantized_engine()
+    torch.backends.quantized.engine = engine
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        prepared = prepare_fx(
+            copy.deepcopy(module).eval(),
+            get_default_qconfig_mapping(engine),
+            example_inputs,
+        )
+        with torch.no_grad():
+            for inputs in calibration:
+                prepared(*inputs)
+        converted = convert_fx(prepared)
+        with torch.no_grad():
+            return torch.jit.trace(converted, example_inputs)
+
+
+def quantize_wav2lip(model, calibration):
+    """Static FX quantization of the face encoder and of the audio encoder +
+    decoder. ``calibration`` is a list of ``(mel, faces)`` CPU tensor batches."""
+    model = model.cpu().eval()
+    encoder, decoder = FaceEncoder(model), Decoder(model)
+
+    mel, faces = calibration[0]
+    q_encoder = _quantize(encoder, (faces,), [(f,) for _, f in calibration])
+    with torch.no_grad():
+        decoder_inputs = [(m,) + encoder(f) for m, f in calibration]
+    q_decoder = _quantize(decoder, decoder_inputs[0], decoder_inputs)
+    return QuantizedWav2Lip(q_encoder, q_decoder)
+
+
+def quantize_s3fd(net, calibration):
+    """Static FX quantization of S3FD; ``calibration`` is a list of
+    preprocessed NCHW image batches (see ``s3fd_input``)."""
+    net = net.cpu().eval()
+    return _quantize(net, (calibration[0],), [(x,) for x in calibration])
+
+
+def s3fd_input(images):
+    # Та же подготовка, что в SFDDetector: BGR -> RGB, вычитание среднего, NCHW
+    images = np.asarray(images)[..., ::-1] - np.array([104, 117, 123])
+    return torch.from_numpy(images.transpose(0, 3, 1, 2).copy()).float()
+
+
+def _artifact_path(quantized_dir, name, source):
+    key = make_key(
+        name, QUANTIZATION_VERSION, source, torch.__version__, quantized_engine()
+    )
+    return os.path.join(quantized_dir, f"{name}_{key[:16]}")
+
+
+def wav2lip_paths(quantized_dir, checkpoint_path):
+    base = _artifact_path(quantized_dir, "wav2lip", file_digest(checkpoint_path))
+    return base + "_encoder.pt", base + "_decoder.pt"
+
+
+def s3fd_path(quantized_dir):
+    source = file_digest(S3FD_PATH) if os.path.isfile(S3FD_PATH) else S3FD_URL
+    return _artifact_path(quantized_dir, "s3fd", source) + ".pt"
+
+
+def save_wav2lip(model, quantized_dir, checkpoint_path):
+    os.makedirs(quantized_dir, exist_ok=True)
+    encoder_path, decoder_path = wav2lip_paths(quantized_dir, checkpoint_path)
+    _save(model.encoder, encoder_path)
+    _save(model.decoder, decoder_path)
+
+
+def save_s3fd(net, quantized_dir):
+    os.makedirs(quantized_dir, exist_ok=True)
+    _save(net, s3fd_path(quantized_dir))
+
+
+def _save(module, path):
+    tmp_path = path + ".tmp"
+    torch.jit.save(module, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_wav2lip(quantized_dir, checkpoint_path):
+    """Quantized Wav2Lip from the disk cache, or None if it was not prepared."""
+    encoder_path, decoder_path = wav2lip_paths(quantized_dir, checkpoint_path)
+    if not (os.path.isfile(encoder_path) and os.path.isfile(decoder_path)):
+        return None
+    torch.backends.quantized.engine = quantized_engine()
+    return QuantizedWav2Lip(
+        torch.jit.load(encoder_path, map_location="cpu"),
+        torch.jit.load(decoder_path, map_location="cpu"),
+    ).eval()
+
+
+def load_s3fd(quantized_dir):
+    """Quantized S3FD from the disk cache, or None if it was not prepared."""
+    path = s3fd_path(quantized_dir)
+    if not os.path.isfile(path):
+        return None
+    torch.backends.quantized.engine = quantized_engine()
+    return torch.jit.load(path, map_location="cpu").eval()
+
+
+def psnr(reference, output):
+    mse = torch.mean((reference - output) ** 2).item()
+    return float("inf") if mse == 0 else 10 * np.log10(1.0 / mse)
+
+
+def box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _best_boxes(net, images):
+    from Wav2Lip.face_detection.detection.sfd.bbox import batch_nms
+    from Wav2Lip.face_detection.detection.sfd.detect import decode_outputs
+
+    with torch.no_grad():
+        dets = batch_nms(decode_outputs(net(images)), 0.3, score_thresh=0.5)
+    return [d[0] if len(d) else None for d in dets]
+
+
+def _rate(fn, n_items, repeat=3):
+    with torch.no_grad():
+        fn()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+    return n_items * repeat / (time.perf_counter() - start)
+
+
+def collect_calibration(video_path, audio_path, n_batches, batch_size):
+    """Real inputs for calibration: Wav2Lip ``(mel, faces)`` batches and
+    downscaled frames for S3FD, produced by the regular preprocessing."""
+    from Wav2Lip.interface import Wav2LipInterface
+
+    iface = Wav2LipInterface(video_path, audio_path)
+    iface.face_cache_dir = None
+    iface.mel_cache_dir = None
+    iface.wav2lip_batch_size = batch_size
+
+    wav2lip_batches, s3fd_batches = [], []
+    mels = iface.process_audio()
+    for img_batch, mel_batch, frames, _ in iface.stream_datagen(mels):
+        wav2lip_batches.append(
+            (
+                torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))),
+                torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))),
+            )
+        )
+        # То же уменьшение кадра, что и при детекции в detect_boxes
+        scale, det_size = iface.detection_size(frames[0].shape)
+        small = [
+            iface.detection_input(f, scale, det_size)
+            for f in frames[: max(1, batch_size // 4)]
+        ]
+        s3fd_batches.append(s3fd_input(small))
+        if len(wav2lip_batches) >= n_batches:
+            break
+    return iface, wav2lip_batches, s3fd_batches
+
+
+def main():
+    from Wav2Lip import model_registry
+
+    parser = argparse.ArgumentParser(description="INT8-квантизация Wav2Lip и S3FD для CPU")
+    parser.add_argument("--video", required=True, help="Видео или фото аватара для калибровки")
+    parser.add_argument("--audio", required=True, help="Аудио для калибровки")
+    parser.add_argument("--checkpoint", default=None, help="Чекпоинт Wav2Lip (по умолчанию wav2lip_gan.pth)")
+    parser.add_argument("--out-dir", default=os.environ.get(
+        "WAV2LIP_QUANTIZED_DIR",
+        os.path.join(os.environ.get("WAV2LIP_CACHE_DIR", "cache"), "quantized"),
+    ), help="Каталог для квантованных моделей")
+    parser.add_argument("--batches", type=int, default=8, help="Батчей для калибровки и проверки")
+    parser.add_argument("--batch-size", type=int, default=16, help="Кадров в батче")
+    parser.add_argument("--force", action="store_true", help="Сохранить, даже если проверка качества не пройдена")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    iface, wav2lip_batches, s3fd_batches = collect_calibration(
+        args.video, args.audio, args.batches, args.batch_size
+    )
+    checkpoint_path = args.checkpoint or iface.checkpoint_path
+
+    # Последний батч не участвует в калибровке, если есть из чего выбрать
+    holdout = 1 if len(wav2lip_batches) > 1 else 0
+    calibration = wav2lip_batches[: len(wav2lip_batches) - holdout]
+    evaluation = wav2lip_batches[len(calibration) :] or calibration
+
+    model = model_registry.load_wav2lip(checkpoint_path, "cpu")
+    q_model = quantize_wav2lip(model, calibration)
+
+    net = model_registry.get_face_detector("cpu").face_detector.face_detector
+    q_net = quantize_s3fd(net, s3fd_batches[: len(s3fd_batches) - holdout])
+
+    with torch.no_grad():
+        wav2lip_psnr = min(
+            psnr(model(mel, faces), q_model(mel, faces)) for mel, faces in evaluation
+        )
+    ious = []
+    for images in s3fd_batches[len(s3fd_batches) - holdout :] or s3fd_batches:
+        for ref, out in zip(_best_boxes(net, images), _best_boxes(q_net, images)):
+            if ref is not None:
+                ious.append(box_iou(ref, out) if out is not None else 0.0)
+    s3fd_iou = float(np.mean(ious)) if ious else float("nan")
+
+    mel, faces = evaluation[0]
+    images = s3fd_batches[0]
+    print(f"Квантизация: {quantized_engine()}, torch {torch.__version__}")
+    print(f"Wav2Lip: PSNR int8 относительно fp32 {wav2lip_psnr:.1f} дБ (порог {MIN_PSNR})")
+    print(f"Wav2Lip: fp32 {_rate(lambda: model(mel, faces), len(faces)):.1f} кадр/с, "
+          f"int8 {_rate(lambda: q_model(mel, faces), len(faces)):.1f} кадр/с")
+    print(f"S3FD: средний IoU int8 относительно fp32 {s3fd_iou:.3f} (порог {MIN_IOU}, лиц {len(ious)})")
+    print(f"S3FD: fp32 {_rate(lambda: net(images), len(images)):.1f} кадр/с, "
+          f"int8 {_rate(lambda: q_net(images), len(images)):.1f} кадр/с")
+
+    passed = wav2lip_psnr >= MIN_PSNR and not (ious and s3fd_iou < MIN_IOU)
+    if not passed and not args.force:
+        print("Проверка качества не пройдена, модели не сохранены")
+        return 1
+
+    save_wav2lip(q_model, args.out_dir, checkpoint_path)
+    save_s3fd(q_net, args.out_dir)
+    print(f"Квантованные модели сохранены в {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+from scipy import signal
+
+
+def moving_average(boxes, T):
+    """Averages every frame with the next ``T - 1`` frames in linear time.
+
+    The last frames, which have no full window ahead of them, reuse the final
+    full window. Values are always read from the input, never from frames that
+    were already smoothed.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    n = len(boxes)
+    if n == 0:
+        return boxes.copy()
+
+    T = max(1, min(T, n))
+    csum = np.cumsum(boxes, axis=0)
+    csum = np.concatenate([np.zeros_like(boxes[:1]), csum])
+    means = (csum[T:] - csum[:-T]) / T
+
+    smoothed = np.empty_like(boxes)
+    smoothed[: n - T + 1] = means
+    smoothed[n - T + 1 :] = means[-1]
+    return smoothed
+
+
+def ema(boxes, alpha=0.5):
+    """Exponential moving average, computed as a first order IIR filter."""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if len(boxes) == 0:
+        return boxes.copy()
+
+    zi = (1 - alpha) * boxes[:1]
+    smoothed, _ = signal.lfilter([alpha], [1, alpha - 1], boxes, axis=0, zi=zi)
+    return smoothed
+
+
+def _smoothing_factor(te, cutoff):
+    r = 2 * math.pi * cutoff * te
+    return r / (r + 1)
+
+
+def one_euro(boxes, fps=25, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+    """One-euro filter: strong smoothing while the face is still, little lag
+    when it moves fast. The filter is adaptive, so it runs frame by frame."""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if len(boxes) == 0:
+        return boxes.copy()
+
+    te = 1.0 / fps
+    a_d = _smoothing_factor(te, d_cutoff)
+
+    smoothed = np.empty_like(boxes)
+    x_prev = smoothed[0] = boxes[0]
+    dx_prev = np.zeros_like(boxes[0])
+    for i in range(1, len(boxes)):
+        dx = (boxes[i] - x_prev) / te
+        dx_prev = a_d * dx + (1 - a_d) * dx_prev
+
+        a = _smoothing_factor(te, min_cutoff + beta * np.abs(dx_prev))
+        x_prev = smoothed[i] = a * boxes[i] + (1 - a) * x_prev
+    return smoothed
+
+
+FILTERS = {
+    "mean": moving_average,
+    "ema": ema,
+    "one_euro": one_euro,
+}
@@ -0,0 +1,136 @@
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+
+class FFmpegWriter:
+    """Streams raw BGR frames to a single ffmpeg process.
+
+    The frames are encoded with libx264 and, when ``audio_path`` is given,
+    muxed with the audio track in the same pass, so no intermediate video file
+    is written and the frames are compressed only once.
+    """
+
+    def __init__(
+        self,
+        output_path,
+        fps,
+        frame_size,
+        audio_path=None,
+        preset="veryfast",
+        crf=18,
+        threads=0,
+        ffmpeg="ffmpeg",
+    ):
+        self.output_path = output_path
+        self.frame_size = tuple(frame_size)
+        width, height = self.frame_size
+
+        command = [
+            ffmpeg, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "pipe:0",
+        ]
+        if audio_path:
+            command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+        command += [
+            # yuv420p требует четных размеров кадра
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-c:v", "libx264", "-preset", str(preset), "-crf", str(crf),
+            "-threads", str(threads), "-pix_fmt", "yuv420p",
+        ]
+        if audio_path:
+            command += ["-c:a", "aac"]
+        command.append(output_path)
+
+        # stderr во временный файл: канал без чтения может заблокировать ffmpeg
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stderr=self._stderr
+        )
+        self.frames = 0
+
+    def write(self, frame):
+        if frame.shape[1::-1] != self.frame_size:
+            raise ValueError(
+                f"Frame size {frame.shape[1::-1]} does not match {self.frame_size}"
+            )
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self._process.wait()
+            raise RuntimeError(f"ffmpeg exited early: {self._error_output()}")
+        self.frames += 1
+
+    def close(self):
+        if self._process.stdin and not self._process.stdin.closed:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self._process.wait()
+        error = self._error_output()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed with code {returncode}: {error}")
+
+    def abort(self):
+        self._process.kill()
+        self._process.wait()
+        if self._process.stdin:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+        self._stderr.close()
+
+    def _error_output(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode("utf-8", "replace").strip()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def concat_segments(segment_paths, output_path, audio_path=None, ffmpeg="ffmpeg"):
+    """Joins video segments encoded with the same settings into one file.
+
+    The concat demuxer with ``-c copy`` stitches the streams without
+    re-encoding; the audio track, if given, is muxed in the same pass.
+    """
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), "segments.txt")
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            # Экранирование кавычек в синтаксисе списка concat
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    command = [
+        ffmpeg, "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+    ]
+    if audio_path:
+        command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+    command += ["-c:v", "copy"]
+    if audio_path:
+        command += ["-c:a", "aac"]
+    command.append(output_path)
+
+    try:
+        result = subprocess.run(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+    finally:
+        os.remove(list_path)
+    if result.returncode != 0:
+        error = result.stderr.decode("utf-8", "replace").strip()
+        raise RuntimeError(f"ffmpeg concat failed with code {result.returncode}: {error}")
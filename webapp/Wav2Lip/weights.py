@@ -0,0 +1,55 @@
+"""
+Пути к весам моделей и их загрузка
+
+Общий модуль для детектора лиц, реестра моделей и команд подготовки моделей
+(квантизация, ONNX, prepare_models); не зависит от остального кода Wav2Lip.
+"""
+
+import logging
+import os
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+S3FD_URL = "https://www.adrianbulat.com/downloads/python-fan/s3fd-619a316812.pth"
+S3FD_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "face_detection", "detection", "sfd", "s3fd.pth",
+)
+
+
+def load_weights(path, map_location="cpu"):
+    """``torch.load`` with memory mapping where supported (torch >= 2.1)."""
+    try:
+        state_dict = torch.load(path, map_location=map_location, mmap=True, weights_only=True)
+    except (TypeError, RuntimeError) as e:
+        # TypeError - torch < 2.1 без параметров mmap/weights_only;
+        # RuntimeError - mmap работает только с zip-форматом torch.save
+        logger.info(f"{os.path.basename(path)}: полное чтение без mmap (torch {torch.__version__}: {e})")
+        return torch.load(path, map_location=map_location)
+    logger.info(f"{os.path.basename(path)}: загружен через mmap")
+    return state_dict
+
+
+def build(module_cls, state_dict, device="cpu"):
+    """Creates ``module_cls()`` with the given weights.
+
+    Where supported, the module is created on the meta device and takes the
+    (memory-mapped) tensors as is, skipping the random initialisation and the
+    copy into freshly allocated parameters.
+    """
+    try:
+        with torch.device("meta"):
+            model = module_cls()
+        model.load_state_dict(state_dict, assign=True)
+        logger.info(f"{module_cls.__name__}: веса подставлены без инициализации (meta)")
+    except (AttributeError, TypeError):
+        # torch < 2.1: нет torch.device как контекста или load_state_dict(assign=)
+        logger.info(
+            f"{module_cls.__name__}: инициализация и копирование весов "
+            f"(torch {torch.__version__} без load_state_dict(assign=True))"
+        )
+        model = module_cls()
+        model.load_state_dict(state_dict)
+    return model.to(device).eval()
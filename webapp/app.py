@@ -20,12 +20,8 @@ import uuid
 from pathlib import Path
 import pyttsx3
 from gtts import gTTS
-import threading
 import time
 
-# Импорт Wav2Lip процессора
-from wav2lip_processor import process_video_with_wav2lip
-
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -42,6 +38,9 @@ app.config['UPLOAD_FOLDER'] = '/app/uploads'
 app.config['OUTPUT_FOLDER'] = '/app/outputs'
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB
 
+# Фотографии вместо видео обрабатываются в режиме статичного аватара
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
 # Создание папок для загрузок
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
@@ -108,6 +107,10 @@ class ProcessingTask(db.Model):
     started_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Поля очереди: какой воркер держит задачу и когда он последний раз отчитывался
+    locked_by = db.Column(db.String(255))
+    heartbeat_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, default=0)
 
 class Result(db.Model):
     """Модель результата"""
@@ -316,8 +319,12 @@ def upload_files(project_id):
         project_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(project.id))
         os.makedirs(project_folder, exist_ok=True)
         
-        # Загрузка видео
-        video_filename = secure_filename(f"video_{uuid.uuid4()}.mp4")
+        # Загрузка видео или фотографии (статичный аватар)
+        extension = os.path.splitext(video_file.filename or '')[1].lower()
+        if extension in IMAGE_EXTENSIONS:
+            video_filename = secure_filename(f"image_{uuid.uuid4()}{extension}")
+        else:
+            video_filename = secure_filename(f"video_{uuid.uuid4()}.mp4")
         video_path = os.path.join(project_folder, video_filename)
         video_file.save(video_path)
         project.video_path = video_path
@@ -327,7 +334,7 @@ def upload_files(project_id):
         project.status = 'content_ready'
         db.session.commit()
         
-        return jsonify({'success': True, 'message': 'Видео и текст загружены'})
+        return jsonify({'success': True, 'message': 'Аватар и текст загружены'})
         
     except Exception as e:
         logger.error(f"Ошибка загрузки файлов: {e}")
@@ -377,7 +384,7 @@ def process_project(project_id):
                 'output_path': output_path,
                 'fps': 25,
                 'img_size': 96,
-                'batch_size': 1
+                'batch_size': None  # подбирается воркером автоматически
             },
             status='queued'
         )
@@ -389,61 +396,8 @@ def process_project(project_id):
         project.status = 'processing'
         db.session.commit()
         
-                # Запуск обработки в отдельном потоке
-        def process_in_background():
-            with app.app_context():
-                try:
-                    logger.info(f"Начинаем обработку проекта {project.id}")
-                    
-                    # Обновляем статус задачи
-                    task.status = 'processing'
-                    task.started_at = datetime.utcnow()
-                    db.session.commit()
-                    
-                    # Запускаем Wav2Lip обработку
-                    success, result = process_video_with_wav2lip(
-                        project.id,
-                        project.video_path,
-                        audio_path,
-                        output_path
-                    )
-                    
-                    if success:
-                        # Обновляем проект
-                        project.output_path = output_path
-                        project.status = 'completed'
-                        
-                        # Обновляем задачу
-                        task.status = 'completed'
-                        task.completed_at = datetime.utcnow()
-                        task.progress = 100
-                        
-                        logger.info(f"Обработка проекта {project.id} завершена успешно")
-                    else:
-                        # Ошибка обработки
-                        project.status = 'failed'
-                        task.status = 'failed'
-                        task.error_message = str(result)
-                        task.completed_at = datetime.utcnow()
-                        
-                        logger.error(f"Ошибка обработки проекта {project.id}: {result}")
-                    
-                    db.session.commit()
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка в фоновой обработке проекта {project.id}: {e}")
-                    
-                    # Обновляем статус при ошибке
-                    project.status = 'failed'
-                    task.status = 'failed'
-                    task.error_message = str(e)
-                    task.completed_at = datetime.utcnow()
-                    db.session.commit()
-        
-        # Запускаем обработку в фоне
-        thread = threading.Thread(target=process_in_background)
-        thread.daemon = True
-        thread.start()
+        # Задача остается в статусе queued, ее заберет отдельный воркер (worker.py)
+        logger.info(f"Задача {task.id} проекта {project.id} поставлена в очередь")
         
         flash('Обработка запущена! Генерация аудио и синхронизация Wav2Lip...', 'success')
         
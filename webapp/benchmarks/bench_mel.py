@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Сверка и бенчмарк вычисления мел-спектрограммы
+Сравнивает audio.melspectrogram (librosa) с audio.melspectrogram_torch по времени и по значениям
+
+Использование: python benchmarks/bench_mel.py [--seconds 600] [--device cpu] [--chunk-frames 8192]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Wav2Lip import audio
+
+
+def make_audio(seconds, sr=16000, seed=0):
+    """Синтетическая речь: тоны с меняющейся громкостью, шум и паузы"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    envelope = (np.sin(2 * np.pi * 0.7 * t) > -0.3) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    wav = envelope * (0.3 * np.sin(2 * np.pi * 180 * t) + 0.1 * np.sin(2 * np.pi * 1100 * t))
+    wav += 0.01 * rng.normal(size=len(t))
+    return wav.astype(np.float32)
+
+
+def timeit(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка librosa и torch бэкендов мел-спектрограммы')
+    parser.add_argument('--seconds', type=float, default=600, help='Длительность аудио')
+    parser.add_argument('--device', default='cpu', help='Устройство для torch (cpu, cuda)')
+    parser.add_argument('--chunk-frames', type=int, default=8192, help='Кадров STFT в одном чанке')
+    parser.add_argument('--tolerance', type=float, default=1e-3,
+                        help='Допустимое отклонение в нормализованной шкале [-4, 4]')
+    args = parser.parse_args()
+
+    wav = make_audio(args.seconds)
+
+    # Прогрев: базис мел-фильтров, инициализация устройства
+    audio.melspectrogram_torch(wav[:16000], device=args.device)
+
+    librosa_time, reference = timeit(lambda: audio.melspectrogram(wav))
+    torch_time, mel = timeit(
+        lambda: audio.melspectrogram_torch(wav, device=args.device, chunk_frames=args.chunk_frames)
+    )
+
+    diff = np.abs(reference - mel)
+    print(f"Аудио: {args.seconds:.0f} с, кадров мел: {mel.shape[1]}")
+    print(f"librosa:       {librosa_time:.2f} с")
+    print(f"torch ({args.device}): {torch_time:.2f} с")
+    print(f"Ускорение:     {librosa_time / torch_time:.1f}x")
+    print(f"Отклонение:    max {diff.max():.2e}, mean {diff.mean():.2e}")
+
+    assert reference.shape == mel.shape, 'Размеры спектрограмм различаются'
+    assert diff.max() <= args.tolerance, 'Отклонение превышает допуск'
+
+
+if __name__ == '__main__':
+    main()
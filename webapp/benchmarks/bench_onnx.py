@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Сверка и бенчмарк ONNX Runtime для Wav2Lip и S3FD
+Экспортирует модели во временный каталог, сравнивает выходы с torch и скорость на CPU
+
+Использование: python benchmarks/bench_onnx.py [--batch 16] [--size 480x640] [--threads 0] [--random-weights]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Wav2Lip import model_registry, onnx_backend
+from Wav2Lip.interface import Wav2LipInterface
+from Wav2Lip.models.wav2lip import Wav2Lip
+from Wav2Lip.face_detection.detection.sfd.net_s3fd import s3fd
+
+
+def load_models(random_weights):
+    """Модели torch: из чекпоинтов или со случайными весами (проверка только графа)"""
+    if random_weights:
+        torch.manual_seed(0)
+        return Wav2Lip().eval(), s3fd().eval(), None
+
+    checkpoint_path = Wav2LipInterface(None, None).checkpoint_path
+    model = model_registry.load_wav2lip(checkpoint_path, 'cpu')
+    net = model_registry.get_face_detector('cpu').face_detector.face_detector
+    return model, net, checkpoint_path
+
+
+def rate(fn, n_items, repeat):
+    with torch.no_grad():
+        fn()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+    return n_items * repeat / (time.perf_counter() - start)
+
+
+def max_diff(reference, outputs):
+    """Максимальное отклонение относительно масштаба выхода (не меньше 1)"""
+    return max(
+        float((r - o).abs().max()) / max(float(r.abs().max()), 1.0)
+        for r, o in zip(reference, outputs)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка и бенчмарк ONNX Runtime')
+    parser.add_argument('--batch', type=int, default=16, help='Кадров в батче Wav2Lip')
+    parser.add_argument('--size', default='480x640', help='Размер кадра для S3FD (ВxШ)')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op потоков ONNX Runtime (0 - авто)')
+    parser.add_argument('--repeat', type=int, default=5, help='Число повторов')
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='Допустимое относительное отклонение выходов')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Случайные веса вместо чекпоинтов (проверяется только экспорт графа)')
+    args = parser.parse_args()
+
+    model, net, checkpoint_path = load_models(args.random_weights)
+    height, width = map(int, args.size.split('x'))
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        if checkpoint_path is None:
+            checkpoint_path = os.path.join(model_dir, 'random.pth')
+            open(checkpoint_path, 'wb').close()
+
+        encoder_path, decoder_path = onnx_backend.export_wav2lip(model, model_dir, checkpoint_path)
+        s3fd_path = onnx_backend.export_s3fd(net, model_dir)
+        ort_model = onnx_backend.OnnxWav2Lip(encoder_path, decoder_path, args.threads)
+        ort_net = onnx_backend.OnnxS3FD(s3fd_path, args.threads)
+
+        rng = np.random.default_rng(0)
+        faces = torch.from_numpy(rng.random((args.batch, 6, 96, 96), dtype=np.float32))
+        mel = torch.from_numpy(rng.normal(size=(args.batch, 1, 80, 16)).astype(np.float32))
+
+        with torch.no_grad():
+            wav2lip_diff = max_diff([model(mel, faces)], [ort_model(mel, faces)])
+            feats_diff = max_diff(model.encode_face(faces), ort_model.encode_face(faces))
+            # Другие размеры батча и кадра проверяют динамические оси
+            s3fd_diff = 0.0
+            for shape in [(1, 3, height, width), (2, 3, height // 2, width // 2 + 8)]:
+                images = torch.from_numpy(rng.normal(0, 50, size=shape).astype(np.float32))
+                s3fd_diff = max(s3fd_diff, max_diff(net(images), ort_net(images)))
+
+        images = torch.from_numpy(rng.normal(0, 50, size=(1, 3, height, width)).astype(np.float32))
+        print(f"Wav2Lip: батч {args.batch}, S3FD: кадр {width}x{height}, потоков ORT: {args.threads or 'авто'}")
+        print(f"Отклонение ONNX от torch: Wav2Lip {wav2lip_diff:.2e}, признаки лица {feats_diff:.2e}, "
+              f"S3FD {s3fd_diff:.2e}")
+        print(f"Wav2Lip torch: {rate(lambda: model(mel, faces), args.batch, args.repeat):.1f} кадр/с")
+        print(f"Wav2Lip ORT:   {rate(lambda: ort_model(mel, faces), args.batch, args.repeat):.1f} кадр/с")
+        print(f"S3FD torch:    {rate(lambda: net(images), 1, args.repeat):.1f} кадр/с")
+        print(f"S3FD ORT:      {rate(lambda: ort_net(images), 1, args.repeat):.1f} кадр/с")
+
+    assert max(wav2lip_diff, feats_diff) <= args.tolerance, 'Выходы Wav2Lip различаются'
+    assert s3fd_diff <= args.tolerance, 'Выходы S3FD различаются'
+
+
+if __name__ == '__main__':
+    main()
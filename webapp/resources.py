@@ -0,0 +1,141 @@
+"""
+Распределение ядер CPU между параллельными задачами обработки
+
+Каждый процесс-воркер (слот) получает свою долю ядер: по ней задаются пулы потоков
+torch, OpenCV, ONNX Runtime и x264, а при WORKER_CPU_AFFINITY=1 процесс
+привязывается к этим ядрам. Без этого каждый процесс создает пулы на все ядра узла
+и параллельные задачи мешают друг другу.
+"""
+
+import os
+import math
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+CPU_AFFINITY = os.environ.get('WORKER_CPU_AFFINITY', '0') == '1'
+
+# Переменные окружения, которые читают OpenMP/MKL/OpenBLAS при загрузке
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+Allocation = namedtuple('Allocation', ['slot', 'slots', 'cpus', 'threads', 'affinity'])
+
+_current = None
+
+
+def available_cpus():
+    """Ядра, доступные процессу (с учетом cpuset контейнера)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_quota():
+    """Лимит CPU контейнера в ядрах (квота cgroup, деленная на период) или None.
+
+    sched_getaffinity его не учитывает: контейнер с --cpus=2 на 32-ядерном узле
+    видит все 32 ядра.
+    """
+    try:
+        # cgroup v2: "<квота> <период>" или "max <период>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota == 'max':
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1: квота -1 - без ограничения
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 and period > 0 else None
+
+
+def _split(total, slot, slots):
+    # Начало и размер доли слота: остаток достается первым слотам
+    base, extra = divmod(total, slots)
+    return slot * base + min(slot, extra), base + (1 if slot < extra else 0)
+
+
+def allocate(slot, slots, cpus=None, affinity=CPU_AFFINITY, quota=None):
+    """Доля ядер для слота: ядра делятся на непересекающиеся непрерывные группы,
+    остаток достается первым слотам. Если слотов больше, чем ядер, слоты
+    делят ядра по кругу с одним потоком на процесс.
+
+    Потоки слота дополнительно ограничиваются квотой CPU контейнера (quota,
+    по умолчанию из cgroup): она так же делится между слотами, округляясь вверх
+    до целых ядер.
+    """
+    cpus = list(cpus if cpus is not None else available_cpus())
+    if quota is None:
+        quota = cpu_quota()
+    slots = max(1, slots)
+    if slots >= len(cpus):
+        share = [cpus[slot % len(cpus)]]
+    else:
+        start, size = _split(len(cpus), slot, slots)
+        share = cpus[start:start + size]
+
+    threads = len(share)
+    if quota is not None:
+        capacity = min(len(cpus), max(1, math.ceil(quota)))
+        threads = max(1, min(threads, _split(capacity, slot, slots)[1]))
+    return Allocation(slot, slots, share, threads, affinity)
+
+
+def apply(allocation):
+    """Применяет распределение к текущему процессу.
+
+    Вызывается до загрузки моделей: переменные окружения OpenMP читаются при
+    импорте torch, а число inter-op потоков torch задается только один раз.
+    """
+    global _current
+
+    threads = str(allocation.threads)
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = threads
+
+    if allocation.affinity and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, allocation.cpus)
+        except OSError as e:
+            logger.warning(f"Не удалось привязать процесс к ядрам {allocation.cpus}: {e}")
+
+    import cv2
+    import torch
+
+    torch.set_num_threads(allocation.threads)
+    try:
+        torch.set_num_interop_threads(max(1, allocation.threads // 2))
+    except RuntimeError:
+        # Пул inter-op потоков уже запущен, его размер не меняется
+        pass
+    cv2.setNumThreads(allocation.threads)
+
+    _current = allocation
+    logger.info(
+        f"Слот {allocation.slot}/{allocation.slots}: {allocation.threads} потоков, "
+        f"ядра {allocation.cpus}" + (" (affinity)" if allocation.affinity else "")
+    )
+    return allocation
+
+
+def current():
+    """Распределение текущего процесса или None, если apply() не вызывался"""
+    return _current
+
+
+def as_dict(allocation):
+    return {
+        'slot': allocation.slot,
+        'slots': allocation.slots,
+        'cpus': list(allocation.cpus),
+        'threads': allocation.threads,
+        'affinity': allocation.affinity,
+    }
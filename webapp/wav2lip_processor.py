@@ -6,6 +6,7 @@
 
 import os
 import sys
+import time
 import logging
 import subprocess
 from pathlib import Path
@@ -13,18 +14,53 @@ from pathlib import Path
 # Добавляем путь к Wav2Lip
 sys.path.append(os.path.join(os.path.dirname(__file__), 'Wav2Lip'))
 
+import resources
 from Wav2Lip.interface import Wav2LipInterface
 
 logger = logging.getLogger(__name__)
 
+# Кеш результатов детекции лиц и других промежуточных данных, общий для всех проектов
+CACHE_DIR = os.environ.get('WAV2LIP_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache'))
+# INT8-модели для CPU-узлов; включаются, если подготовлены командой python -m Wav2Lip.quantization
+QUANTIZE = os.environ.get('WAV2LIP_QUANTIZE', '0') == '1'
+QUANTIZED_DIR = os.environ.get('WAV2LIP_QUANTIZED_DIR', os.path.join(CACHE_DIR, 'quantized'))
+# Бэкенд инференса: torch или onnx (модели готовятся командой python -m Wav2Lip.onnx_backend)
+BACKEND = os.environ.get('WAV2LIP_BACKEND', 'torch')
+ONNX_DIR = os.environ.get('WAV2LIP_ONNX_DIR', os.path.join(CACHE_DIR, 'onnx'))
+ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', '0'))
+ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', '0'))
+# Подготовленные веса для быстрого старта (python -m Wav2Lip.prepare_models)
+PREPARED_DIR = os.environ.get('WAV2LIP_PREPARED_DIR', os.path.join(CACHE_DIR, 'prepared'))
+# Полная детекция лица на каждом N-м кадре (1 - на каждом кадре)
+DETECT_EVERY = int(os.environ.get('WAV2LIP_DETECT_EVERY', '10'))
+# Число сегментов длинного ролика, которые рендерятся параллельно в отдельных процессах
+SEGMENTS = int(os.environ.get('WAV2LIP_SEGMENTS', '1'))
+# Паузы в речи: cached - одно предсказание для тишины на кадр (только для зацикленного
+# видео и фото, иначе off), passthrough - исходный кадр, off
+SILENCE_MODE = os.environ.get('WAV2LIP_SILENCE_MODE', 'cached')
+
+# Время холодного старта процесса (загрузка и прогрев моделей), с
+_cold_start_s = None
+
+
+def budget_threads(configured):
+    """Число потоков с учетом доли ядер процесса: 0 заменяется долей из resources"""
+    allocation = resources.current()
+    if configured or allocation is None:
+        return configured
+    return allocation.threads
+
+
 class Wav2LipProcessor:
     """Класс для обработки видео с помощью Wav2Lip"""
     
-    def __init__(self, project_id, video_path, audio_path, output_path):
+    def __init__(self, project_id, video_path, audio_path, output_path, parameters=None):
         self.project_id = project_id
         self.video_path = video_path
         self.audio_path = audio_path
         self.output_path = output_path
+        # Параметры задачи; фактически выбранные значения записываются обратно
+        self.parameters = parameters if parameters is not None else {}
         
         # Создаем временную директорию для проекта
         self.temp_dir = os.path.join(os.path.dirname(__file__), 'temp', str(project_id))
@@ -48,8 +84,41 @@ class Wav2LipProcessor:
             # Настраиваем параметры
             wav2lip.fps = 25
             wav2lip.img_size = 96
-            wav2lip.wav2lip_batch_size = 1
+            # None - размер батча подбирается автоматически под устройство
+            wav2lip.wav2lip_batch_size = self.parameters.get('batch_size')
+            if self.parameters.get('max_batch_size'):
+                wav2lip.wav2lip_max_batch_size = int(self.parameters['max_batch_size'])
             wav2lip.temp_dir = self.temp_dir
+            # True - одна детекция по первому кадру (для фото включается автоматически)
+            wav2lip.static = self.parameters.get('static')
+            wav2lip.face_cache_dir = os.path.join(CACHE_DIR, 'faces')
+            wav2lip.mel_cache_dir = os.path.join(CACHE_DIR, 'mels')
+            wav2lip.quantize = self.parameters.get('quantize', QUANTIZE)
+            wav2lip.quantized_dir = QUANTIZED_DIR
+            wav2lip.backend = self.parameters.get('backend', BACKEND)
+            wav2lip.onnx_dir = ONNX_DIR
+            wav2lip.ort_intra_op_threads = budget_threads(
+                self.parameters.get('ort_intra_op_threads', ORT_INTRA_OP_THREADS)
+            )
+            wav2lip.ort_inter_op_threads = self.parameters.get('ort_inter_op_threads', ORT_INTER_OP_THREADS)
+            wav2lip.prepared_dir = PREPARED_DIR
+            # Мел-спектрограмма в torch на устройстве модели (librosa - эталонный путь)
+            wav2lip.audio_backend = self.parameters.get('audio_backend', 'torch')
+            # Полная детекция лица раз в detect_every кадров и при смене сцены/движении
+            wav2lip.detect_every = int(self.parameters.get('detect_every') or DETECT_EVERY)
+            self.parameters['detect_every'] = wav2lip.detect_every
+            # Число потоков стадий конвейера, например {"prepare": 2, "paste": 2}
+            wav2lip.pipeline_workers.update(self.parameters.get('pipeline_workers') or {})
+            # Рендер по сегментам: ролик делится на части не короче 10 с
+            wav2lip.segments = int(self.parameters.get('segments') or SEGMENTS)
+            wav2lip.segment_workers = self.parameters.get('segment_workers')
+            wav2lip.silence_mode = self.parameters.get('silence_mode', SILENCE_MODE)
+            # Настройки кодировщика x264 итогового видео
+            wav2lip.x264_preset = self.parameters.get('x264_preset', wav2lip.x264_preset)
+            wav2lip.x264_crf = self.parameters.get('x264_crf', wav2lip.x264_crf)
+            wav2lip.encoder_threads = budget_threads(
+                self.parameters.get('encoder_threads', wav2lip.encoder_threads)
+            )
             
             # Дополнительная защита от деления на ноль
             if wav2lip.fps <= 0:
@@ -60,6 +129,18 @@ class Wav2LipProcessor:
             
             # Запускаем обработку
             wav2lip.generate()
+            self.parameters.update(wav2lip.run_info)
+            if _cold_start_s is not None:
+                self.parameters['worker_cold_start_s'] = _cold_start_s
+
+            stages = wav2lip.run_info.get('pipeline') or {}
+            if stages:
+                bottleneck = max(stages, key=lambda name: stages[name]['utilization'])
+                logger.info(
+                    "Загрузка стадий: " +
+                    ", ".join(f"{name}={info['utilization']:.0%}" for name, info in stages.items()) +
+                    f"; узкое место - {bottleneck}"
+                )
             
             logger.info(f"Обработка завершена. Результат: {self.output_path}")
             
@@ -79,9 +160,31 @@ class Wav2LipProcessor:
         except Exception as e:
             logger.error(f"Ошибка очистки временных файлов: {e}")
 
-def process_video_with_wav2lip(project_id, video_path, audio_path, output_path):
+def warmup_models():
+    """Предзагрузка и прогрев моделей Wav2Lip и S3FD в текущем процессе"""
+    global _cold_start_s
+    try:
+        logger.info("Загружаем модели Wav2Lip...")
+        start = time.perf_counter()
+        wav2lip = Wav2LipInterface(video_path=None, audio_path=None)
+        wav2lip.quantize = QUANTIZE
+        wav2lip.quantized_dir = QUANTIZED_DIR
+        wav2lip.backend = BACKEND
+        wav2lip.onnx_dir = ONNX_DIR
+        wav2lip.ort_intra_op_threads = budget_threads(ORT_INTRA_OP_THREADS)
+        wav2lip.ort_inter_op_threads = ORT_INTER_OP_THREADS
+        wav2lip.prepared_dir = PREPARED_DIR
+        wav2lip.warmup()
+        _cold_start_s = round(time.perf_counter() - start, 3)
+        logger.info(f"Модели Wav2Lip загружены и прогреты за {_cold_start_s} с")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка предзагрузки моделей Wav2Lip: {e}")
+        return False
+
+def process_video_with_wav2lip(project_id, video_path, audio_path, output_path, parameters=None):
     """Функция для обработки видео с Wav2Lip"""
-    processor = Wav2LipProcessor(project_id, video_path, audio_path, output_path)
+    processor = Wav2LipProcessor(project_id, video_path, audio_path, output_path, parameters)
     
     try:
         success, result = processor.process()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Воркер очереди задач обработки
+Забирает задачи из таблицы processing_tasks и выполняет Wav2Lip вне веб-процессов
+"""
+
+import os
+import sys
+import signal
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+import multiprocessing.connection
+from datetime import datetime
+
+from sqlalchemy import text
+
+import resources
+from app import app, db, ProcessingTask
+
+logger = logging.getLogger(__name__)
+
+# Настройки очереди
+POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', '2'))
+HEARTBEAT_INTERVAL = float(os.environ.get('WORKER_HEARTBEAT_INTERVAL', '30'))
+STALE_TIMEOUT = int(os.environ.get('WORKER_STALE_TIMEOUT', '300'))
+MAX_ATTEMPTS = int(os.environ.get('WORKER_MAX_ATTEMPTS', '3'))
+# Пауза перед перезапуском упавшего процесса слота, с
+RESPAWN_DELAY = float(os.environ.get('WORKER_RESPAWN_DELAY', '5'))
+
+# Задача берется, если она в очереди или если ее воркер перестал отправлять heartbeat
+# (например, контейнер был перезапущен посреди обработки)
+CLAIM_TASK_SQL = text("""
+    UPDATE processing_tasks
+    SET status = 'processing',
+        started_at = CURRENT_TIMESTAMP,
+        heartbeat_at = CURRENT_TIMESTAMP,
+        locked_by = :worker_id,
+        attempts = COALESCE(attempts, 0) + 1
+    WHERE id = (
+        SELECT id FROM processing_tasks
+        WHERE status = 'queued'
+           OR (status = 'processing'
+               AND COALESCE(heartbeat_at, started_at, created_at) < CURRENT_TIMESTAMP - make_interval(secs => :stale_timeout)
+               AND COALESCE(attempts, 0) < :max_attempts)
+        ORDER BY created_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id
+""")
+
+FAIL_EXHAUSTED_SQL = text("""
+    UPDATE processing_tasks
+    SET status = 'failed',
+        error_message = 'Превышено число попыток обработки',
+        completed_at = CURRENT_TIMESTAMP
+    WHERE status = 'processing'
+      AND COALESCE(heartbeat_at, started_at, created_at) < CURRENT_TIMESTAMP - make_interval(secs => :stale_timeout)
+      AND COALESCE(attempts, 0) >= :max_attempts
+    RETURNING project_id
+""")
+
+HEARTBEAT_SQL = text("""
+    UPDATE processing_tasks
+    SET heartbeat_at = CURRENT_TIMESTAMP
+    WHERE id = :task_id AND locked_by = :worker_id
+""")
+
+# Поля очереди для таблиц, созданных до ее появления (в новых базах они есть в init.sql)
+QUEUE_COLUMNS = {
+    'locked_by': "VARCHAR(255)",
+    'heartbeat_at': "TIMESTAMP WITH TIME ZONE",
+    'attempts': "INTEGER DEFAULT 0",
+}
+QUEUE_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_tasks_queue ON processing_tasks(created_at) "
+    "WHERE status IN ('queued', 'processing')"
+)
+# ALTER TABLE ждет ACCESS EXCLUSIVE блокировку даже с IF NOT EXISTS, а все запросы
+# к таблице ждут за ним; без таймаута миграция повесит очередь за долгой транзакцией
+SCHEMA_LOCK_TIMEOUT = os.environ.get('WORKER_SCHEMA_LOCK_TIMEOUT', '5s')
+
+
+def ensure_queue_schema():
+    """Добавление полей очереди в уже существующую таблицу processing_tasks.
+
+    Схема сначала читается из information_schema, DDL выполняется только для
+    недостающих полей и индекса, поэтому обычный старт воркера не берет
+    блокировок на таблицу.
+    """
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            columns = {
+                row.column_name for row in conn.execute(text(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_name = 'processing_tasks' AND table_schema = current_schema()"
+                ))
+            }
+            has_index = conn.execute(text(
+                "SELECT 1 FROM pg_indexes "
+                "WHERE indexname = 'idx_tasks_queue' AND schemaname = current_schema()"
+            )).first() is not None
+
+            missing = [name for name in QUEUE_COLUMNS if name not in columns]
+            if not missing and has_index:
+                return
+
+            logger.info(f"Обновляем схему очереди: поля {missing}, индекс: {not has_index}")
+            conn.execute(text("SELECT set_config('lock_timeout', :timeout, true)"),
+                         {'timeout': SCHEMA_LOCK_TIMEOUT})
+            for name in missing:
+                conn.execute(text(
+                    f"ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS {name} {QUEUE_COLUMNS[name]}"
+                ))
+            if not has_index:
+                conn.execute(text(QUEUE_INDEX_SQL))
+
+
+def claim_task(worker_id):
+    """Атомарно забирает следующую задачу из очереди, возвращает ее id или None"""
+    with db.engine.begin() as conn:
+        for row in conn.execute(FAIL_EXHAUSTED_SQL, {
+            'stale_timeout': STALE_TIMEOUT,
+            'max_attempts': MAX_ATTEMPTS,
+        }):
+            conn.execute(
+                text("UPDATE projects SET status = 'failed' WHERE id = :project_id"),
+                {'project_id': row.project_id}
+            )
+
+        row = conn.execute(CLAIM_TASK_SQL, {
+            'worker_id': worker_id,
+            'stale_timeout': STALE_TIMEOUT,
+            'max_attempts': MAX_ATTEMPTS,
+        }).first()
+    return row.id if row else None
+
+
+def get_setting(key, default=None):
+    """Значение из таблицы settings"""
+    row = db.session.execute(
+        text("SELECT value FROM settings WHERE key = :key"), {'key': key}
+    ).first()
+    return row.value if row else default
+
+
+def heartbeat_loop(task_id, worker_id, stop_event):
+    """Периодически продлевает владение задачей, пока она обрабатывается"""
+    with app.app_context():
+        while not stop_event.wait(HEARTBEAT_INTERVAL):
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(HEARTBEAT_SQL, {'task_id': task_id, 'worker_id': worker_id})
+            except Exception as e:
+                logger.error(f"Ошибка обновления heartbeat задачи {task_id}: {e}")
+
+
+def run_task(task_id, worker_id):
+    """Выполнение одной задачи обработки"""
+    # Импорт здесь, чтобы веб-процессы не загружали torch и модели
+    from wav2lip_processor import process_video_with_wav2lip
+
+    task = db.session.get(ProcessingTask, task_id)
+    project = task.project
+    project_id = project.id
+    video_path = project.video_path
+    parameters = dict(task.parameters or {})
+    parameters.setdefault('max_batch_size', get_setting('max_batch_size'))
+    allocation = resources.current()
+    if allocation is not None:
+        parameters['resources'] = resources.as_dict(allocation)
+
+    # Транзакция чтения закрывается до рендера: иначе она висит открытой десятки
+    # минут и держит блокировки на processing_tasks
+    db.session.commit()
+    db.session.close()
+
+    logger.info(f"[{worker_id}] Начинаем обработку задачи {task_id} проекта {project_id}")
+
+    stop_event = threading.Event()
+    heartbeat = threading.Thread(
+        target=heartbeat_loop, args=(task_id, worker_id, stop_event), daemon=True
+    )
+    heartbeat.start()
+
+    try:
+        success, result = process_video_with_wav2lip(
+            project_id,
+            video_path,
+            parameters['audio_path'],
+            parameters['output_path'],
+            parameters
+        )
+    except Exception as e:
+        success, result = False, str(e)
+    finally:
+        stop_event.set()
+        heartbeat.join()
+
+    task = db.session.get(ProcessingTask, task_id)
+    if task is None or task.locked_by != worker_id:
+        logger.warning(f"[{worker_id}] Задача {task_id} была перехвачена другим воркером")
+        db.session.rollback()
+        return
+    project = task.project
+
+    # Сохраняем фактически использованные параметры (размеры батчей и т.д.)
+    task.parameters = parameters
+
+    if success:
+        project.output_path = parameters['output_path']
+        project.status = 'completed'
+
+        task.status = 'completed'
+        task.completed_at = datetime.utcnow()
+        task.progress = 100
+
+        logger.info(f"[{worker_id}] Обработка проекта {project.id} завершена успешно")
+    else:
+        project.status = 'failed'
+        task.status = 'failed'
+        task.error_message = str(result)
+        task.completed_at = datetime.utcnow()
+
+        logger.error(f"[{worker_id}] Ошибка обработки проекта {project.id}: {result}")
+
+    db.session.commit()
+
+
+def worker_loop(slot, slots, stop_event):
+    """Основной цикл процесса-воркера: забрать задачу, обработать, повторить"""
+    logging.basicConfig(level=logging.INFO)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{slot}"
+
+    # Доля ядер слота задается до загрузки torch и моделей
+    resources.apply(resources.allocate(slot, slots))
+
+    from wav2lip_processor import warmup_models
+    warmup_models()
+
+    with app.app_context():
+        logger.info(f"[{worker_id}] Воркер запущен")
+        while not stop_event.is_set():
+            try:
+                task_id = claim_task(worker_id)
+            except Exception as e:
+                logger.error(f"[{worker_id}] Ошибка получения задачи из очереди: {e}")
+                task_id = None
+
+            if task_id is None:
+                stop_event.wait(POLL_INTERVAL)
+                continue
+
+            try:
+                run_task(task_id, worker_id)
+            except Exception as e:
+                logger.error(f"[{worker_id}] Ошибка выполнения задачи {task_id}: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+        logger.info(f"[{worker_id}] Воркер остановлен")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воркер очереди обработки Wav2Lip')
+    parser.add_argument(
+        '--concurrency', type=int,
+        default=int(os.environ.get('WORKER_CONCURRENCY', '1')),
+        help='Число параллельно обрабатываемых задач (процессов) на этом узле'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ensure_queue_schema()
+
+    # spawn: каждому процессу свои CUDA-контекст и пул соединений с БД
+    ctx = multiprocessing.get_context('spawn')
+    stop_event = ctx.Event()
+    slots = max(1, args.concurrency)
+
+    def start_slot(slot):
+        process = ctx.Process(target=worker_loop, args=(slot, slots, stop_event), name=f"worker-{slot}")
+        process.start()
+        return process
+
+    processes = {slot: start_slot(slot) for slot in range(slots)}
+
+    def shutdown(signum, frame):
+        logger.info("Получен сигнал остановки, завершаем текущие задачи...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # Слот, завершившийся до остановки (OOM, падение в нативном коде), запускается
+    # заново; иначе узел молча работал бы с меньшим числом слотов. Его задачу
+    # вернет в очередь проверка heartbeat.
+    while not stop_event.is_set():
+        multiprocessing.connection.wait(
+            [process.sentinel for process in processes.values()], timeout=POLL_INTERVAL
+        )
+        for slot, process in processes.items():
+            if process.is_alive() or stop_event.is_set():
+                continue
+            logger.error(f"Процесс слота {slot} завершился с кодом {process.exitcode}, перезапускаем")
+            if stop_event.wait(RESPAWN_DELAY):
+                break
+            processes[slot] = start_slot(slot)
+
+    for process in processes.values():
+        process.join()
+
+    return 0 if all(process.exitcode == 0 for process in processes.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())